@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core import signing
+from . stores import NotEnoughStock, get_cart_store
+
+# Anonymous carts live entirely in a signed cookie: [[product_id, quantity], ...].
+# Browsing and adding items never writes to the database; the cart is
+# merged into the user's real cart when they log in or register.
+GUEST_CART_COOKIE = "guest_cart"
+GUEST_CART_SALT = "cart.guest"
+MAX_GUEST_CART_LINES = 100
+
+
+# product_id -> quantity from the cookie (or a token passed explicitly);
+# a missing, tampered or expired token is just an empty cart
+def load_guest_cart(request, token=None):
+    token = token or request.COOKIES.get(GUEST_CART_COOKIE)
+    if not token:
+        return {}
+
+    try:
+        lines = signing.loads(token, salt=GUEST_CART_SALT, max_age=settings.GUEST_CART_MAX_AGE)
+        return {int(product_id): int(quantity) for product_id, quantity in lines}
+    except (signing.BadSignature, TypeError, ValueError):
+        return {}
+
+
+def dump_guest_cart(lines):
+    return signing.dumps(list(lines.items()), salt=GUEST_CART_SALT, compress=True)
+
+
+def set_guest_cart_cookie(response, lines):
+    if not lines:
+        response.delete_cookie(GUEST_CART_COOKIE)
+        return
+
+    response.set_cookie(
+        GUEST_CART_COOKIE,
+        dump_guest_cart(lines),
+        max_age=settings.GUEST_CART_MAX_AGE,
+        httponly=True,
+        samesite="Lax"
+    )
+
+
+# Fold a guest cart into the user's cart with one batch write. Returns True
+# if the guest cart was merged (or empty) and can be discarded.
+def merge_guest_cart(user, lines):
+    if not lines:
+        return True
+
+    try:
+        get_cart_store().apply_batch(
+            user,
+            [{"op": "add", "product_id": product_id, "quantity": quantity} for product_id, quantity in lines.items()]
+        )
+    except NotEnoughStock:
+        return False
+    return True
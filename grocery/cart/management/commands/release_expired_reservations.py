@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from cart.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = "Delete expired stock reservations in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        now = timezone.now()
+        total = 0
+
+        # Expired holds are already ignored by availability checks; this only
+        # keeps the table small so those aggregates stay cheap.
+        while True:
+            ids = list(
+                StockReservation.objects.filter(expires_at__lte=now)
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            StockReservation.objects.filter(id__in=ids).delete()
+            total += len(ids)
+
+        self.stdout.write(f"Released {total} expired reservations")
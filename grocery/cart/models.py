@@ -4,6 +4,13 @@ from products.models import Product
 
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
+    # Running totals kept up to date by every cart write so the cart can be
+    # summarised without reading its lines. subtotal is NULL when a price
+    # change made it stale; it is then recomputed on the next read.
+    item_count = models.IntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, null=True, default=0)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.user.username}'s Cart"
@@ -21,3 +28,19 @@ class Wishlist(models.Model):
 
     class Meta:
         unique_together = ('user', 'product')
+
+
+# Stock held for a cart line while STOCK_RESERVATIONS is on. Available-to-sell
+# for a product is stock minus the sum of its unexpired rows, which the
+# (product, expires_at) index answers without touching other tables.
+class StockReservation(models.Model):
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
+    cart_item = models.OneToOneField(CartItem, on_delete=models.CASCADE, related_name='reservation')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'expires_at'], name='reservation_product_idx'),
+        ]
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+from products.models import Product
+from . models import StockReservation
+
+
+def reservations_enabled():
+    return settings.STOCK_RESERVATIONS
+
+
+# product_id -> units held by unexpired reservations, optionally ignoring
+# the holds of one cart (its own holds don't count against it)
+def reserved_quantities(product_ids, exclude_cart=None):
+    reservations = StockReservation.objects.filter(
+        product_id__in=product_ids,
+        expires_at__gt=timezone.now()
+    )
+    if exclude_cart is not None:
+        reservations = reservations.exclude(cart=exclude_cart)
+
+    return dict(
+        reservations.values("product_id")
+        .annotate(total=Sum("quantity"))
+        .values_list("product_id", "total")
+    )
+
+
+# product_id -> quantity this cart currently holds
+def held_quantities(cart):
+    return dict(
+        StockReservation.objects.filter(cart=cart, expires_at__gt=timezone.now())
+        .values_list("product_id", "quantity")
+    )
+
+
+# Hold item.quantity units for a cart line and restart its TTL. Must run
+# inside a transaction: the product row stays locked until commit so two
+# carts can't reserve the same last units. Returns False if not enough stock.
+def reserve_stock(item):
+    product = Product.objects.select_for_update().only("id", "stock").get(id=item.product_id)
+    held_by_others = reserved_quantities([product.id], exclude_cart=item.cart_id).get(product.id, 0)
+
+    if product.stock - held_by_others < item.quantity:
+        return False
+
+    StockReservation.objects.update_or_create(
+        cart_item=item,
+        defaults={
+            "cart_id": item.cart_id,
+            "product_id": product.id,
+            "quantity": item.quantity,
+            "expires_at": timezone.now() + settings.STOCK_RESERVATION_TTL,
+        }
+    )
+    return True
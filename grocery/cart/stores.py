@@ -0,0 +1,411 @@
+import uuid
+from collections import namedtuple
+from decimal import Decimal
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import DecimalField, F, Sum
+from django.utils import timezone
+from products.locks import cache_lock
+from products.models import Product
+from . models import Cart, CartItem
+from . reservations import reservations_enabled, reserve_stock
+
+# Cart lines as the views see them: flat (line id, product name, quantity,
+# unit price) tuples, rendered without building model instances. The line
+# id is what clients send back to update/remove the line.
+ITEM_ROW_COLUMNS = ["id", "product__name", "quantity", "product__price"]
+
+# Cart totals; item_count is the number of units, version changes on every write
+CartSummary = namedtuple("CartSummary", ["item_count", "subtotal", "version"])
+
+# Changed whenever a product's name or price changes so cache-store ETags
+# go stale too
+PRODUCTS_VERSION_KEY = "cart:products_version"
+
+
+class NotEnoughStock(Exception):
+    pass
+
+
+def get_user_cart(user):
+    cart, created = Cart.objects.get_or_create(user=user)
+    return cart
+
+
+# Cart/CartItem rows in the database (the default). Cart carries running
+# totals that every write here adjusts with a single F() update.
+class DatabaseCartStore:
+
+    def get_lines(self, user):
+        # product_id -> quantity, one query
+        return dict(
+            CartItem.objects.filter(cart__user=user).order_by("id").values_list("product_id", "quantity")
+        )
+
+    def get_item_rows(self, user):
+        return list(
+            CartItem.objects.filter(cart__user=user).order_by("id").values_list(*ITEM_ROW_COLUMNS)
+        )
+
+    def get_summary(self, user):
+        cart = Cart.objects.filter(user=user).first()
+        if cart is None:
+            return CartSummary(0, Decimal("0"), 0)
+
+        if cart.subtotal is None:
+            self.recompute(cart)
+
+        return CartSummary(cart.item_count, cart.subtotal, cart.version)
+
+    def etag(self, user):
+        version = Cart.objects.filter(user=user).values_list("version", flat=True).first()
+        return f"cart-{version or 0}"
+
+    def add(self, user, product, quantity):
+        cart = get_user_cart(user)
+
+        with transaction.atomic():
+            item, created = CartItem.objects.get_or_create(cart=cart, product=product)
+            if not created:
+                item.quantity += quantity
+            else:
+                item.quantity = quantity
+
+            # Reservation mode: hold the stock now rather than at checkout
+            if reservations_enabled() and not reserve_stock(item):
+                transaction.set_rollback(True)
+                raise NotEnoughStock(product.name)
+
+            item.save()
+            self.adjust(cart.id, quantity, product.price * quantity)
+
+    def set_quantity(self, user, item_id, quantity):
+        with transaction.atomic():
+            try:
+                item = CartItem.objects.select_related("product").get(id=item_id, cart__user=user)
+            except CartItem.DoesNotExist:
+                return False
+
+            change = quantity - item.quantity
+            item.quantity = quantity
+
+            if reservations_enabled() and not reserve_stock(item):
+                transaction.set_rollback(True)
+                raise NotEnoughStock(item.product.name)
+
+            item.save()
+            self.adjust(item.cart_id, change, item.product.price * change)
+        return True
+
+    def remove(self, user, item_id):
+        with transaction.atomic():
+            try:
+                item = CartItem.objects.select_related("product").get(id=item_id, cart__user=user)
+            except CartItem.DoesNotExist:
+                return False
+
+            item.delete()
+            self.adjust(item.cart_id, -item.quantity, -item.product.price * item.quantity)
+        return True
+
+    def clear(self, user):
+        # Also drops the lines' stock reservations (cascade)
+        CartItem.objects.filter(cart__user=user).delete()
+        Cart.objects.filter(user=user).update(
+            item_count=0,
+            subtotal=0,
+            version=F("version") + 1,
+            updated_at=timezone.now()
+        )
+
+    def apply_batch(self, user, operations):
+        cart = get_user_cart(user)
+        product_ids = batch_product_ids(operations)
+
+        with transaction.atomic():
+            products = Product.objects.in_bulk(product_ids)
+            items = {
+                item.product_id: item
+                for item in CartItem.objects.select_for_update().filter(cart=cart, product_id__in=product_ids)
+            }
+            current = {product_id: item.quantity for product_id, item in items.items()}
+            results, lines = run_operations(current, operations, products)
+
+            to_create = []
+            to_update = []
+            for product_id, quantity in lines.items():
+                item = items.get(product_id)
+                if item is None:
+                    to_create.append(CartItem(cart=cart, product_id=product_id, quantity=quantity))
+                elif item.quantity != quantity:
+                    item.quantity = quantity
+                    to_update.append(item)
+            to_delete = [item.id for product_id, item in items.items() if product_id not in lines]
+
+            if reservations_enabled():
+                # Reservations hang off saved rows, so new lines are saved
+                # one by one here; every changed line is then re-reserved
+                for item in to_create:
+                    item.save()
+                for item in to_create + to_update:
+                    if not reserve_stock(item):
+                        transaction.set_rollback(True)
+                        raise NotEnoughStock(products[item.product_id].name)
+            else:
+                CartItem.objects.bulk_create(to_create)
+
+            CartItem.objects.bulk_update(to_update, ["quantity"])
+            CartItem.objects.filter(id__in=to_delete).delete()
+
+            changes = {
+                product_id: lines.get(product_id, 0) - current.get(product_id, 0)
+                for product_id in set(lines) | set(current)
+            }
+            if any(changes.values()):
+                self.adjust(
+                    cart.id,
+                    sum(changes.values()),
+                    sum((products[pid].price * change for pid, change in changes.items()), Decimal("0"))
+                )
+
+        return results
+
+    def adjust(self, cart_id, quantity, amount):
+        # A stale (NULL) subtotal stays NULL until the next recompute
+        Cart.objects.filter(id=cart_id).update(
+            item_count=F("item_count") + quantity,
+            subtotal=F("subtotal") + amount,
+            version=F("version") + 1,
+            updated_at=timezone.now()
+        )
+
+    def recompute(self, cart):
+        totals = CartItem.objects.filter(cart=cart).aggregate(
+            item_count=Sum("quantity"),
+            subtotal=Sum(
+                F("quantity") * F("product__price"),
+                output_field=DecimalField(max_digits=12, decimal_places=2)
+            )
+        )
+        cart.item_count = totals["item_count"] or 0
+        cart.subtotal = totals["subtotal"] or Decimal("0")
+
+        # Skip the write if the cart changed meanwhile; the next read retries
+        Cart.objects.filter(id=cart.id, version=cart.version).update(
+            item_count=cart.item_count,
+            subtotal=cart.subtotal
+        )
+
+
+# Whole cart as one cache entry: {"lines": [[product_id, quantity], ...],
+# "version": n} in insertion order. Nothing touches the database until
+# checkout turns it into an order. Line ids are product ids. Stock
+# reservations need the database store. Every write is a read-modify-write
+# of the whole entry, so writes to one cart hold a short per-cart lock
+# (products.locks) and parallel requests can't drop each other's lines.
+CART_LOCK_TIMEOUT = 5
+# Longer than the timeout, so a lock left by a crashed worker is taken over
+CART_LOCK_WAIT = 10
+
+
+class CacheCartStore:
+
+    def __init__(self):
+        if settings.STOCK_RESERVATIONS:
+            raise ImproperlyConfigured("STOCK_RESERVATIONS needs CART_STORE = 'database'")
+        self.cache = caches[settings.CART_CACHE_ALIAS]
+        self.timeout = settings.CART_CACHE_TIMEOUT
+        # (lines, version) last returned by get_lines(), for clear()
+        self.checked_out = None
+
+    def key(self, user):
+        return f"cart:{user.id}"
+
+    def locked(self, user):
+        return cache_lock(self.key(user), CART_LOCK_TIMEOUT, CART_LOCK_WAIT, alias=settings.CART_CACHE_ALIAS)
+
+    def load(self, user):
+        blob = self.cache.get(self.key(user)) or {"lines": [], "version": 0}
+        return dict(blob["lines"]), blob["version"]
+
+    # Callers hold locked(user)
+    def save(self, user, lines, version):
+        # Emptied carts are kept (not deleted) so the version never goes back
+        blob = {"lines": list(lines.items()), "version": version + 1}
+        self.cache.set(self.key(user), blob, self.timeout)
+
+    def get_lines(self, user):
+        lines, version = self.load(user)
+
+        # Lines for products deleted since they were added are dropped for
+        # good (the database store's CartItems go with the product)
+        if lines:
+            existing = set(Product.objects.filter(id__in=list(lines)).values_list("id", flat=True))
+            if len(existing) < len(lines):
+                with self.locked(user):
+                    lines, version = self.load(user)
+                    lines = {pid: quantity for pid, quantity in lines.items() if pid in existing}
+                    self.save(user, lines, version)
+                    version += 1
+
+        self.checked_out = (lines, version)
+        return lines
+
+    def get_item_rows(self, user):
+        lines, version = self.load(user)
+        # Lines for products deleted since they were added are dropped
+        products = {
+            product_id: (name, price)
+            for product_id, name, price in Product.objects.filter(id__in=list(lines)).values_list("id", "name", "price")
+        }
+        return [
+            (product_id, products[product_id][0], quantity, products[product_id][1])
+            for product_id, quantity in lines.items()
+            if product_id in products
+        ]
+
+    def get_summary(self, user):
+        lines, version = self.load(user)
+        prices = dict(Product.objects.filter(id__in=list(lines)).values_list("id", "price"))
+        subtotal = sum(
+            (prices[pid] * quantity for pid, quantity in lines.items() if pid in prices),
+            Decimal("0")
+        )
+        item_count = sum(quantity for pid, quantity in lines.items() if pid in prices)
+        return CartSummary(item_count, subtotal, version)
+
+    def etag(self, user):
+        products_version = self.cache.get(PRODUCTS_VERSION_KEY, 0)
+        return f"cart-{self.load(user)[1]}-{products_version}"
+
+    def add(self, user, product, quantity):
+        with self.locked(user):
+            lines, version = self.load(user)
+            lines[product.id] = lines.get(product.id, 0) + quantity
+            self.save(user, lines, version)
+
+    def set_quantity(self, user, item_id, quantity):
+        with self.locked(user):
+            lines, version = self.load(user)
+            if item_id not in lines:
+                return False
+            lines[item_id] = quantity
+            self.save(user, lines, version)
+        return True
+
+    def remove(self, user, item_id):
+        with self.locked(user):
+            lines, version = self.load(user)
+            if lines.pop(item_id, None) is None:
+                return False
+            self.save(user, lines, version)
+        return True
+
+    def apply_batch(self, user, operations):
+        products = Product.objects.in_bulk(batch_product_ids(operations))
+        with self.locked(user):
+            lines, version = self.load(user)
+            results, lines = run_operations(lines, operations, products)
+            self.save(user, lines, version)
+        return results
+
+    # Empty the cart after checkout, once the order is really committed. If
+    # the cart changed after checkout read it (get_lines), only the ordered
+    # quantities come out and lines added in the meantime stay.
+    def clear(self, user):
+        checked_out = self.checked_out
+
+        def empty():
+            with self.locked(user):
+                lines, version = self.load(user)
+                if checked_out is None or version == checked_out[1]:
+                    lines = {}
+                else:
+                    for product_id, quantity in checked_out[0].items():
+                        left = lines.get(product_id, 0) - quantity
+                        if left > 0:
+                            lines[product_id] = left
+                        else:
+                            lines.pop(product_id, None)
+                self.save(user, lines, version)
+
+        transaction.on_commit(empty)
+
+
+BATCH_OPERATIONS = ("add", "set", "remove")
+
+
+def batch_product_ids(operations):
+    product_ids = set()
+    for operation in operations:
+        try:
+            product_ids.add(int(operation["product_id"]))
+        except (KeyError, TypeError, ValueError):
+            pass
+    return product_ids
+
+
+# Apply add/set/remove operations in order to a product_id -> quantity map.
+# Returns a result per operation and the resulting lines; failed operations
+# leave the lines untouched. Setting a quantity below 1 removes the line.
+def run_operations(lines, operations, products):
+    lines = dict(lines)
+    results = []
+
+    for index, operation in enumerate(operations):
+        result = {"index": index}
+        results.append(result)
+
+        try:
+            kind = operation["op"]
+            product_id = int(operation["product_id"])
+            quantity = int(operation.get("quantity", 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            result.update(status="error", error="Each operation needs an op and a numeric product_id and quantity")
+            continue
+
+        result.update(op=kind, product_id=product_id)
+
+        if kind not in BATCH_OPERATIONS:
+            result.update(status="error", error=f"Unknown op {kind}")
+        elif product_id not in products:
+            result.update(status="error", error="Product not found")
+        elif kind == "add":
+            if quantity < 1:
+                result.update(status="error", error="Quantity must be at least 1")
+                continue
+            lines[product_id] = lines.get(product_id, 0) + quantity
+            result.update(status="ok", quantity=lines[product_id])
+        elif product_id not in lines:
+            result.update(status="error", error="Product not in cart")
+        elif kind == "set" and quantity > 0:
+            lines[product_id] = quantity
+            result.update(status="ok", quantity=quantity)
+        else:
+            del lines[product_id]
+            result.update(status="ok", quantity=0)
+
+    return results, lines
+
+
+CART_STORES = {
+    "database": DatabaseCartStore,
+    "cache": CacheCartStore,
+}
+
+
+def get_cart_store():
+    return CART_STORES[settings.CART_STORE]()
+
+
+# Call when products shown in carts change (name or price) or are deleted:
+# database carts holding them get their subtotal recomputed on next read,
+# and every cart ETag changes so clients don't keep a stale cached cart.
+def cart_products_changed(product_ids):
+    Cart.objects.filter(items__product_id__in=product_ids).update(
+        subtotal=None,
+        version=F("version") + 1
+    )
+    caches[settings.CART_CACHE_ALIAS].set(PRODUCTS_VERSION_KEY, uuid.uuid4().hex, None)
@@ -1,3 +1,318 @@
-from django.test import TestCase
+import tempfile
+import threading
+from datetime import timedelta
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from products.models import Category, Product
+from users.models import User
+from . models import CartItem, StockReservation, Wishlist
+from . stores import CacheCartStore
 
-# Create your tests here.
+def client_for(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+@override_settings(STOCK_RESERVATIONS=True, CART_STORE="database")
+class StockReservationTests(TestCase):
+
+    def setUp(self):
+        self.alice = client_for(User.objects.create_user(username="alice", password="x"))
+        self.bob = client_for(User.objects.create_user(username="bob", password="x"))
+        category = Category.objects.create(name="fruit")
+        self.product = Product.objects.create(name="apple", category=category, price="1.00", stock=5)
+
+    def add(self, client, quantity):
+        return client.post("/cart/add/", {"product_id": self.product.id, "quantity": quantity}, format="json")
+
+    def expire_holds(self):
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_held_units_cannot_be_added_by_another_cart(self):
+        self.assertEqual(self.add(self.alice, 4).status_code, 200)
+
+        response = self.add(self.bob, 2)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"error": "Not enough stock for apple"})
+        self.assertEqual(self.add(self.bob, 1).status_code, 200)
+        self.assertEqual(CartItem.objects.filter(cart__user__username="bob").get().quantity, 1)
+
+    def test_quantity_update_is_held_too(self):
+        self.add(self.alice, 2)
+        self.add(self.bob, 2)
+        item = CartItem.objects.get(cart__user__username="bob")
+
+        response = self.bob.put("/cart/update/", {"item_id": item.id, "quantity": 4}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CartItem.objects.get(id=item.id).quantity, 2)
+        self.assertEqual(StockReservation.objects.get(cart_item=item).quantity, 2)
+
+    def test_both_holders_can_check_out(self):
+        self.add(self.alice, 4)
+        self.add(self.bob, 1)
+
+        self.assertEqual(self.alice.post("/orders/checkout/", {}, format="json").status_code, 201)
+        self.assertEqual(self.bob.post("/orders/checkout/", {}, format="json").status_code, 201)
+        self.assertEqual(Product.objects.get(id=self.product.id).stock, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_expired_holds_free_the_stock(self):
+        self.add(self.alice, 5)
+        self.expire_holds()
+
+        self.assertEqual(self.add(self.bob, 4).status_code, 200)
+
+        # Alice's line lost its hold; checkout can't use the units Bob holds
+        response = self.alice.post("/orders/checkout/", {}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Product.objects.get(id=self.product.id).stock, 5)
+
+
+class WishlistTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="x")
+        self.client = client_for(self.user)
+        category = Category.objects.create(name="fruit")
+        self.products = Product.objects.bulk_create([
+            Product(name=f"product {i}", category=category, price="1.00", stock=1)
+            for i in range(5)
+        ])
+
+        response = self.client.post(
+            "/cart/wishlist/add/", {"product_ids": [p.id for p in self.products]}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_cursor_walks_every_item_newest_first(self):
+        expected = list(Wishlist.objects.filter(user=self.user).order_by("-id").values_list("id", flat=True))
+
+        for limit in (1, 2, 5, 10):
+            ids = []
+            response = self.client.get(f"/cart/wishlist/?limit={limit}")
+            while True:
+                self.assertLessEqual(len(response.data["results"]), limit)
+                ids += [item["id"] for item in response.data["results"]]
+                if response.data["next"] is None:
+                    break
+                response = self.client.get(f"/cart/wishlist/?limit={limit}&cursor={response.data['next']}")
+
+            self.assertEqual(ids, expected)
+
+    def test_page_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/cart/wishlist/?limit=5")
+
+        self.assertEqual(
+            {item["product"] for item in response.data["results"]},
+            {product.name for product in self.products}
+        )
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get("/cart/wishlist/?cursor=abc").status_code, 400)
+        self.assertEqual(self.client.get("/cart/wishlist/?limit=0").status_code, 400)
+
+    def test_move_to_cart(self):
+        moving = [self.products[0].id, self.products[1].id]
+
+        response = self.client.post("/cart/wishlist/move-to-cart/", {"product_ids": moving}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.data["moved"]), moving)
+        self.assertEqual(
+            sorted(CartItem.objects.filter(cart__user=self.user).values_list("product_id", "quantity")),
+            [(product_id, 1) for product_id in moving]
+        )
+        self.assertEqual(Wishlist.objects.filter(user=self.user).count(), 3)
+
+
+@override_settings(STOCK_RESERVATIONS=False, CART_STORE="database")
+class BatchCartTests(TestCase):
+
+    def setUp(self):
+        # Cache carts outlive the test transaction
+        cache.clear()
+        self.client = client_for(User.objects.create_user(username="alice", password="x"))
+        category = Category.objects.create(name="fruit")
+        self.apple, self.pear = Product.objects.bulk_create([
+            Product(name="apple", category=category, price="2.00", stock=10),
+            Product(name="pear", category=category, price="3.00", stock=10),
+        ])
+
+    def batch(self, operations):
+        return self.client.post("/cart/batch/", {"operations": operations}, format="json")
+
+    def cart(self):
+        return {item["product"]: item["quantity"] for item in self.client.get("/cart/").data}
+
+    def test_operations_run_in_order(self):
+        response = self.batch([
+            {"op": "add", "product_id": self.apple.id, "quantity": 2},
+            {"op": "add", "product_id": self.apple.id},
+            {"op": "add", "product_id": self.pear.id, "quantity": 4},
+            {"op": "set", "product_id": self.pear.id, "quantity": 1},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["quantity"] for r in response.data["results"]], [2, 3, 4, 1])
+        self.assertEqual(self.cart(), {"apple": 3, "pear": 1})
+        self.assertEqual(self.client.get("/cart/summary/").data["subtotal"], 9.0)
+
+    def test_failed_operations_leave_the_rest(self):
+        self.batch([{"op": "add", "product_id": self.apple.id}])
+
+        response = self.batch([
+            {"op": "remove", "product_id": self.pear.id},
+            {"op": "add", "product_id": 999},
+            {"op": "swap", "product_id": self.apple.id},
+            {"op": "add", "product_id": self.pear.id, "quantity": 0},
+            {"product_id": self.pear.id},
+            {"op": "remove", "product_id": self.apple.id},
+            {"op": "add", "product_id": self.pear.id},
+        ])
+
+        self.assertEqual(
+            [r.get("error") for r in response.data["results"]],
+            [
+                "Product not in cart",
+                "Product not found",
+                "Unknown op swap",
+                "Quantity must be at least 1",
+                "Each operation needs an op and a numeric product_id and quantity",
+                None,
+                None,
+            ]
+        )
+        self.assertEqual(self.cart(), {"pear": 1})
+
+    def test_bad_bodies(self):
+        self.assertEqual(self.batch([]).status_code, 400)
+        self.assertEqual(self.client.post("/cart/batch/", {"operations": "add"}, format="json").status_code, 400)
+
+
+@override_settings(CART_STORE="cache")
+class CacheStoreBatchCartTests(BatchCartTests):
+    pass
+
+
+@override_settings(STOCK_RESERVATIONS=False, CART_STORE="cache")
+class CacheCartStoreTests(TestCase):
+
+    def setUp(self):
+        # The project's file cache, where cache.add() is not atomic
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_cache = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory.name}
+        self.enterContext(override_settings(CACHES={"default": file_cache}))
+
+        self.user = User.objects.create_user(username="alice", password="x")
+        category = Category.objects.create(name="fruit")
+        self.products = Product.objects.bulk_create([
+            Product(name=f"product {i}", category=category, price="1.00", stock=10)
+            for i in range(40)
+        ])
+
+    def test_parallel_adds_keep_every_line(self):
+        def add_products(products):
+            store = CacheCartStore()
+            for product in products:
+                store.add(self.user, product, 1)
+
+        threads = [threading.Thread(target=add_products, args=(self.products[i::8],)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        lines, version = CacheCartStore().load(self.user)
+        self.assertEqual(set(lines), {product.id for product in self.products})
+        self.assertEqual(version, 40)
+
+    def test_checkout_keeps_lines_added_after_it_read_the_cart(self):
+        apple, pear = self.products[:2]
+        CacheCartStore().add(self.user, apple, 2)
+
+        store = CacheCartStore()
+        self.assertEqual(store.get_lines(self.user), {apple.id: 2})
+        # Another request adds to the cart while the order is being written
+        CacheCartStore().add(self.user, apple, 1)
+        CacheCartStore().add(self.user, pear, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            store.clear(self.user)
+
+        self.assertEqual(CacheCartStore().load(self.user)[0], {apple.id: 1, pear.id: 1})
+
+    def test_checkout_empties_an_unchanged_cart(self):
+        store = CacheCartStore()
+        store.add(self.user, self.products[0], 2)
+        store.get_lines(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            store.clear(self.user)
+
+        self.assertEqual(CacheCartStore().load(self.user)[0], {})
+
+    def test_lines_of_deleted_products_are_dropped(self):
+        store = CacheCartStore()
+        store.add(self.user, self.products[0], 1)
+        store.add(self.user, self.products[1], 1)
+        Product.objects.filter(id=self.products[0].id).delete()
+
+        self.assertEqual(store.get_lines(self.user), {self.products[1].id: 1})
+        self.assertEqual(store.load(self.user)[0], {self.products[1].id: 1})
+
+
+@override_settings(STOCK_RESERVATIONS=False, CART_STORE="database")
+class CartETagTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = client_for(User.objects.create_user(username="alice", password="x"))
+        self.manager = client_for(User.objects.create_user(username="manager", password="x", role="manager"))
+        category = Category.objects.create(name="fruit")
+        self.product = Product.objects.create(name="apple", category=category, price="2.00", stock=10)
+        self.client.post("/cart/add/", {"product_id": self.product.id, "quantity": 1}, format="json")
+
+    def refetch(self, etag):
+        return self.client.get("/cart/", HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_cart_is_not_modified(self):
+        etag = self.client.get("/cart/")["ETag"]
+
+        self.assertEqual(self.refetch(etag).status_code, 304)
+
+    def test_rename_changes_the_etag(self):
+        etag = self.client.get("/cart/")["ETag"]
+
+        self.manager.put(f"/products/{self.product.id}/", {"name": "green apple"}, format="json")
+
+        response = self.refetch(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]["product"], "green apple")
+
+    def test_price_change_changes_the_etag(self):
+        etag = self.client.get("/cart/")["ETag"]
+
+        self.manager.put(f"/products/{self.product.id}/", {"price": "2.50"}, format="json")
+
+        response = self.refetch(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]["price"], 2.5)
+
+    def test_stock_change_keeps_the_etag(self):
+        etag = self.client.get("/cart/")["ETag"]
+
+        self.manager.put(f"/products/{self.product.id}/", {"stock": 3}, format="json")
+
+        self.assertEqual(self.refetch(etag).status_code, 304)
+
+
+@override_settings(CART_STORE="cache")
+class CacheStoreCartETagTests(CartETagTests):
+    pass
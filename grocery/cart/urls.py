@@ -3,11 +3,19 @@ from . import views
 
 urlpatterns = [
     path('', views.view_cart),
+    path('summary/', views.cart_summary),
     path('add/', views.add_to_cart),
     path('remove/', views.remove_from_cart),
     path('update/', views.update_cart),
+    path('batch/', views.batch_cart),
+
+    path('guest/', views.view_guest_cart),
+    path('guest/add/', views.add_to_guest_cart),
+    path('guest/remove/', views.remove_from_guest_cart),
+    path('guest/update/', views.update_guest_cart),
 
     path('wishlist/', views.view_wishlist),
     path('wishlist/add/', views.add_to_wishlist),
     path('wishlist/remove/', views.remove_from_wishlist),
+    path('wishlist/move-to-cart/', views.move_wishlist_to_cart),
 ]
\ No newline at end of file
@@ -1,36 +1,64 @@
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from . models import Cart, CartItem, Wishlist
+from django.db import transaction
+from django.utils.http import parse_etags, quote_etag
+from . models import Wishlist
+from . guest import MAX_GUEST_CART_LINES, dump_guest_cart, load_guest_cart, set_guest_cart_cookie
+from . stores import NotEnoughStock, get_cart_store
 from products.models import Product
+from products.renderers import RowRenderer, line_total, to_float
 
 
-def get_user_cart(user):
-    cart, created = Cart.objects.get_or_create(user=user)
-    return cart
+# CART: VIEW CART
+# Lines come from one query. The ETag is the cart version, so a client
+# holding the current version gets a 304 after a single cheap lookup.
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def view_cart(request):
+    store = get_cart_store()
 
+    etag = quote_etag(store.etag(request.user))
+    if not_modified(request, etag):
+        return Response(status=304, headers={"ETag": etag})
 
+    rows = store.get_item_rows(request.user)
 
-# CART: VIEW CART
+    return Response(CART_ITEM_RENDERER(rows), headers={"ETag": etag})
+
+
+# Reads store.get_item_rows() tuples (stores.ITEM_ROW_COLUMNS)
+CART_ITEM_RENDERER = RowRenderer(
+    ("id", "id"),
+    ("product", "product__name"),
+    ("quantity", "quantity"),
+    ("price", "product__price", to_float),
+    ("total", ("product__price", "quantity"), line_total),
+)
+
+
+# CART: SUMMARY (totals without reading the lines)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def view_cart(request):
-    cart = get_user_cart(request.user)
-    items = CartItem.objects.filter(cart=cart)
+def cart_summary(request):
+    store = get_cart_store()
 
-    serializer = [
-        {
-            "id": item.id,
-            "product": item.product.name,
-            "quantity": item.quantity,
-            "price": float(item.product.price),
-            "total": float(item.product.price * item.quantity)
-        }
-        for item in items
-    ]
+    etag = quote_etag(store.etag(request.user))
+    if not_modified(request, etag):
+        return Response(status=304, headers={"ETag": etag})
 
-    return Response(serializer)
+    summary = store.get_summary(request.user)
+
+    return Response({
+        "item_count": summary.item_count,
+        "subtotal": float(summary.subtotal),
+        "version": summary.version
+    }, headers={"ETag": etag})
+
+
+def not_modified(request, etag):
+    return etag in parse_etags(request.headers.get("If-None-Match", ""))
 
 
 
@@ -46,15 +74,10 @@ def add_to_cart(request):
     except Product.DoesNotExist:
         return Response({"error": "Product not found"}, status=404)
 
-    cart = get_user_cart(request.user)
-
-    item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-    if not created:
-        item.quantity += int(quantity)
-    else:
-        item.quantity = int(quantity)
-
-    item.save()
+    try:
+        get_cart_store().add(request.user, product, int(quantity))
+    except NotEnoughStock:
+        return Response({"error": f"Not enough stock for {product.name}"}, status=400)
 
     return Response({"message": "Added to cart"})
 
@@ -65,12 +88,9 @@ def add_to_cart(request):
 def remove_from_cart(request):
     item_id = request.data.get("item_id")
 
-    try:
-        item = CartItem.objects.get(id=item_id, cart__user=request.user)
-        item.delete()
+    if item_id is not None and get_cart_store().remove(request.user, int(item_id)):
         return Response({"message": "Item removed"})
-    except CartItem.DoesNotExist:
-        return Response({"error": "Cart item not found"}, status=404)
+    return Response({"error": "Cart item not found"}, status=404)
 
 
 # CART: UPDATE QUANTITY
@@ -80,13 +100,16 @@ def update_cart(request):
     item_id = request.data.get("item_id")
     quantity = request.data.get("quantity")
 
-    try:
-        item = CartItem.objects.get(id=item_id, cart__user=request.user)
-    except CartItem.DoesNotExist:
+    if item_id is None:
         return Response({"error": "Item not found"}, status=404)
 
-    item.quantity = int(quantity)
-    item.save()
+    try:
+        found = get_cart_store().set_quantity(request.user, int(item_id), int(quantity))
+    except NotEnoughStock:
+        return Response({"error": "Not enough stock"}, status=400)
+
+    if not found:
+        return Response({"error": "Item not found"}, status=404)
 
     return Response({"message": "Quantity updated"})
 
@@ -95,26 +118,177 @@ def update_cart(request):
 
 
 
-# WISHLIST: VIEW
+# CART: BATCH (add / set / remove many products in one request)
+# Body: {"operations": [{"op": "add" | "set" | "remove", "product_id": 1, "quantity": 2}, ...]}
+# Operations run in order inside one transaction; each gets its own result.
+MAX_BATCH_OPERATIONS = 500
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch_cart(request):
+    operations = request.data.get("operations") if isinstance(request.data, dict) else request.data
+
+    if not isinstance(operations, list) or not operations:
+        return Response({"error": "operations must be a non-empty list"}, status=400)
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return Response({"error": f"At most {MAX_BATCH_OPERATIONS} operations per request"}, status=400)
+
+    try:
+        results = get_cart_store().apply_batch(request.user, operations)
+    except NotEnoughStock as e:
+        return Response({"error": f"Not enough stock for {e}"}, status=400)
+
+    return Response({"results": results})
+
+
+
+# GUEST CART (anonymous shoppers)
+# Kept in a signed cookie (see cart.guest); these views only read products,
+# they never write to the database. The signed token is also returned in
+# the body for clients that don't keep cookies.
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def view_guest_cart(request):
+    lines = load_guest_cart(request, request.headers.get("X-Guest-Cart"))
+    products = Product.objects.in_bulk(list(lines))
+
+    serializer = [
+        {
+            "id": product_id,
+            "product": products[product_id].name,
+            "quantity": quantity,
+            "price": float(products[product_id].price),
+            "total": float(products[product_id].price * quantity)
+        }
+        for product_id, quantity in lines.items()
+        if product_id in products
+    ]
+
+    return Response(serializer)
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def add_to_guest_cart(request):
+    product_id = request.data.get("product_id")
+    quantity = int(request.data.get("quantity", 1))
+
+    if quantity < 1:
+        return Response({"error": "Quantity must be at least 1"}, status=400)
+
+    if not Product.objects.filter(id=product_id).exists():
+        return Response({"error": "Product not found"}, status=404)
+
+    lines = load_guest_cart(request, request.headers.get("X-Guest-Cart"))
+    product_id = int(product_id)
+
+    if product_id not in lines and len(lines) >= MAX_GUEST_CART_LINES:
+        return Response({"error": "Guest cart is full, please log in"}, status=400)
+
+    lines[product_id] = lines.get(product_id, 0) + quantity
+    return guest_cart_response({"message": "Added to cart"}, lines)
+
+
+@api_view(['PUT'])
+@permission_classes([AllowAny])
+def update_guest_cart(request):
+    lines = load_guest_cart(request, request.headers.get("X-Guest-Cart"))
+    product_id = int(request.data.get("item_id", 0))
+    quantity = int(request.data.get("quantity"))
+
+    if product_id not in lines:
+        return Response({"error": "Item not found"}, status=404)
+
+    if quantity > 0:
+        lines[product_id] = quantity
+    else:
+        del lines[product_id]
+    return guest_cart_response({"message": "Quantity updated"}, lines)
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def remove_from_guest_cart(request):
+    lines = load_guest_cart(request, request.headers.get("X-Guest-Cart"))
+    product_id = int(request.data.get("item_id", 0))
+
+    if lines.pop(product_id, None) is None:
+        return Response({"error": "Cart item not found"}, status=404)
+    return guest_cart_response({"message": "Item removed"}, lines)
+
+
+def guest_cart_response(data, lines):
+    data["guest_cart"] = dump_guest_cart(lines) if lines else None
+    response = Response(data)
+    set_guest_cart_cookie(response, lines)
+    return response
+
+
+
+# WISHLIST: VIEW (newest first, paginated by id)
+WISHLIST_PAGE_SIZE = 50
+MAX_WISHLIST_PAGE_SIZE = 200
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def view_wishlist(request):
-    items = Wishlist.objects.filter(user=request.user)
+    try:
+        limit = min(int(request.GET.get("limit", WISHLIST_PAGE_SIZE)), MAX_WISHLIST_PAGE_SIZE)
+        cursor = request.GET.get("cursor")
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        return Response({"error": "limit and cursor must be numbers"}, status=400)
+    if limit < 1:
+        return Response({"error": "limit must be positive"}, status=400)
+
+    items = Wishlist.objects.filter(user=request.user).order_by("-id")
+    if cursor is not None:
+        items = items.filter(id__lt=cursor)
+
+    # One query; product names come from the join, not per-row lookups
+    page = list(items.values("id", "product__name")[:limit + 1])
+    has_next = len(page) > limit
+    page = page[:limit]
+
     serializer = [
         {
-            "id": item.id,
-            "product": item.product.name
+            "id": item["id"],
+            "product": item["product__name"]
         }
-        for item in items
+        for item in page
     ]
-    return Response(serializer)
+    return Response({
+        "next": str(page[-1]["id"]) if has_next else None,
+        "results": serializer
+    })
 
 
-# WISHLIST: ADD
+# WISHLIST: ADD (one product_id, or a product_ids list)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def add_to_wishlist(request):
 
+    if "product_ids" in request.data:
+        try:
+            product_ids = parse_product_ids(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        found = set(Product.objects.filter(id__in=product_ids).values_list("id", flat=True))
+
+        # Duplicates are skipped by the (user, product) unique index
+        Wishlist.objects.bulk_create(
+            [Wishlist(user=request.user, product_id=product_id) for product_id in found],
+            ignore_conflicts=True
+        )
+
+        return Response({
+            "message": "Added to wishlist",
+            "not_found": [product_id for product_id in product_ids if product_id not in found]
+        })
+
     product_id = request.data.get("product_id")
 
     try:
@@ -127,10 +301,20 @@ def add_to_wishlist(request):
     return Response({"message": "Added to wishlist"})
 
 
-# WISHLIST: REMOVE
+# WISHLIST: REMOVE (one product_id, or a product_ids list)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def remove_from_wishlist(request):
+
+    if "product_ids" in request.data:
+        try:
+            product_ids = parse_product_ids(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        removed, _ = Wishlist.objects.filter(user=request.user, product_id__in=product_ids).delete()
+        return Response({"message": "Removed from wishlist", "removed": removed})
+
     product_id = request.data.get("product_id")
 
     try:
@@ -140,3 +324,48 @@ def remove_from_wishlist(request):
     except Wishlist.DoesNotExist:
         return Response({"error": "Not found in wishlist"}, status=404)
 
+
+# WISHLIST: MOVE TO CART
+# Adds one of each selected wishlist product to the cart (a single batch
+# write) and drops them from the wishlist with one delete.
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def move_wishlist_to_cart(request):
+    try:
+        product_ids = parse_product_ids(request.data)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    with transaction.atomic():
+        wishlist = Wishlist.objects.filter(user=request.user, product_id__in=product_ids)
+        moving = list(wishlist.values_list("product_id", flat=True))
+        if not moving:
+            return Response({"error": "Not found in wishlist"}, status=404)
+
+        try:
+            get_cart_store().apply_batch(
+                request.user,
+                [{"op": "add", "product_id": product_id, "quantity": 1} for product_id in moving]
+            )
+        except NotEnoughStock as e:
+            transaction.set_rollback(True)
+            return Response({"error": f"Not enough stock for {e}"}, status=400)
+
+        wishlist.delete()
+
+    return Response({"message": "Moved to cart", "moved": moving})
+
+
+MAX_WISHLIST_BULK = 500
+
+
+def parse_product_ids(data):
+    product_ids = data.get("product_ids")
+    if not isinstance(product_ids, list) or not product_ids:
+        raise ValueError("product_ids must be a non-empty list")
+    if len(product_ids) > MAX_WISHLIST_BULK:
+        raise ValueError(f"At most {MAX_WISHLIST_BULK} product_ids per request")
+    try:
+        return [int(product_id) for product_id in product_ids]
+    except (TypeError, ValueError):
+        raise ValueError("product_ids must be numbers")
@@ -38,13 +38,46 @@ REST_FRAMEWORK = {
     )
 }
 
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=180),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
 
+# How long a stored Idempotency-Key response can be replayed
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
+# Hold stock when items are added to a cart instead of only checking it at checkout
+STOCK_RESERVATIONS = os.getenv("STOCK_RESERVATIONS", "False").lower() == "true"
+STOCK_RESERVATION_TTL = timedelta(minutes=15)
+
+# Where carts live: "database" (Cart/CartItem rows) or "cache" (one cache
+# entry per cart, written to the database only as an order at checkout).
+# Stock reservations need the database store (the cache store refuses to start).
+CART_STORE = os.getenv("CART_STORE", "database")
+CART_CACHE_ALIAS = "default"
+CART_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+# Lifetime of cached public product responses (seconds); writes invalidate sooner
+PRODUCT_CACHE_TIMEOUT = 300
+
+# Lifetime of the signed guest cart cookie (seconds)
+GUEST_CART_MAX_AGE = 60 * 60 * 24 * 30
+
+# Orders older than this are moved to the archive tables by archive_orders
+ORDER_ARCHIVE_AFTER = timedelta(days=365)
+
+# Lifetime of cached report figures for closed periods (seconds); they never
+# change, this only bounds how long unused ones stay around
+REPORT_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+# Trending scores halve every TRENDING_HALF_LIFE. Scores are stored relative
+# to TRENDING_EPOCH and grow with time; move the epoch forward and run
+# rebuild_trending every few years to keep them well inside float range.
+TRENDING_HALF_LIFE = timedelta(days=7)
+TRENDING_EPOCH = datetime(2026, 1, 1)
+
 # import dj_database_url
 # import os
 
@@ -152,6 +185,20 @@ DATABASES = {
 
 
 
+# Cache
+# File-based so every gunicorn worker on the host sees the same entries
+# (promo cache version, etc). Point CACHE_LOCATION at a shared directory.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv("CACHE_LOCATION", os.path.join(BASE_DIR, "cache")),
+        # carts can live here (CART_STORE = "cache"), so don't cull at 300
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,10 @@
+# Settings for the test suite: `python manage.py test` picks them up (see
+# manage.py). Same as production except the cache, which is a private
+# in-memory one so tests never share or wipe the real file cache.
+from . settings import *  # noqa: F401,F403
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'grocery.settings')
+    # The test suite runs on its own settings (private in-memory cache)
+    default_settings = 'grocery.test_settings' if sys.argv[1:2] == ['test'] else 'grocery.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', default_settings)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
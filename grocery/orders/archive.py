@@ -0,0 +1,115 @@
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from products.locks import cache_lock
+from . models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+
+# Move orders created before `before` (and their items) into the archive
+# tables, batch_size orders per transaction so locks are short and the
+# move can run while the shop is live. Returns the number of orders moved.
+def archive_orders(before, batch_size=500):
+    moved = 0
+
+    while True:
+        with transaction.atomic():
+            orders = list(
+                Order.objects.select_for_update()
+                .filter(created_at__lt=before)
+                .order_by("id")[:batch_size]
+            )
+            if not orders:
+                break
+
+            order_ids = [order.id for order in orders]
+            items = list(OrderItem.objects.filter(order_id__in=order_ids))
+
+            ArchivedOrder.objects.bulk_create([
+                ArchivedOrder(
+                    id=order.id,
+                    user_id=order.user_id,
+                    total_price=order.total_price,
+                    created_at=order.created_at
+                )
+                for order in orders
+            ])
+            ArchivedOrderItem.objects.bulk_create([
+                ArchivedOrderItem(
+                    id=item.id,
+                    order_id=item.order_id,
+                    product_id=item.product_id,
+                    price=item.price,
+                    quantity=item.quantity
+                )
+                for item in items
+            ])
+
+            OrderItem.objects.filter(order_id__in=order_ids).delete()
+            Order.objects.filter(id__in=order_ids).delete()
+
+        moved += len(orders)
+
+    return moved
+
+
+# (order model, order item model) pairs a reader should scan
+def order_tables(include_archive=False):
+    tables = [(Order, OrderItem)]
+    if include_archive:
+        tables.append((ArchivedOrder, ArchivedOrderItem))
+    return tables
+
+
+# Orders newer than this are left alone by jobs that walk orders by id, so
+# a checkout still committing under a lower id can't be skipped past
+ORDER_SETTLE_TIME = timedelta(minutes=5)
+# How long such a job's run lock lasts if its worker dies without releasing it
+JOB_LOCK_TIMEOUT = 60 * 60
+
+
+# Highest order id old enough for such jobs to read
+def settled_order_id():
+    cutoff = timezone.now() - ORDER_SETTLE_TIME
+    return Order.objects.filter(created_at__lt=cutoff).order_by("-id").values_list("id", flat=True).first() or 0
+
+
+# Walk orders in id order, chunk_size at a time, for jobs that keep a
+# checkpoint: yields (item model, after, last_id, count, live) for the
+# `count` orders with after < id <= last_id. Live orders start after `after` and stop at
+# `upto`; with include_archive every archived order follows. Only live
+# chunks should move a checkpoint.
+def order_chunks(after, upto, include_archive=False, chunk_size=10000):
+    for order_model, item_model in order_tables(include_archive):
+        live = order_model is Order
+        last_id = after if live else 0
+
+        while True:
+            order_ids = order_model.objects.filter(id__gt=last_id)
+            if live:
+                order_ids = order_ids.filter(id__lte=upto)
+            order_ids = list(order_ids.order_by("id").values_list("id", flat=True)[:chunk_size])
+            if not order_ids:
+                break
+
+            yield item_model, last_id, order_ids[-1], len(order_ids), live
+            last_id = order_ids[-1]
+
+
+# Held for a whole run of a checkpointed job, so a run started while the
+# last one is still going (an overrunning cron, a rebuild) doesn't read the
+# same orders again. LockTimeout straight away if another run holds it.
+def job_lock(name):
+    return cache_lock(f"job:{name}", JOB_LOCK_TIMEOUT, wait=0)
+
+
+# Move a job's checkpoint (a single-row model) from `after` to `last_id`,
+# inside the transaction that writes the chunk. The row stays locked until
+# that commits. False if another run moved the checkpoint first: that run
+# has already counted these orders and this one should stop.
+def advance_checkpoint(model, after, last_id):
+    checkpoint = model.objects.select_for_update().get(id=1)
+    if checkpoint.last_order_id != after:
+        return False
+    checkpoint.last_order_id = last_id
+    checkpoint.save()
+    return True
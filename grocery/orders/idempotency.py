@@ -0,0 +1,95 @@
+import hashlib
+from functools import wraps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+from . models import IdempotencyKey
+
+MAX_KEY_LENGTH = 255
+
+
+# Replay the stored response when a client retries a request with the same
+# Idempotency-Key header, path and body (a different one gets a 422). The
+# key row is claimed before the view runs, so a retry that arrives while the
+# original is still in flight gets a 409 instead of running the whole view a
+# second time.
+#
+# Must sit below @api_view / @permission_classes so request.user is set.
+def idempotent(view):
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return view(request, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({"error": "Idempotency-Key is too long"}, status=400)
+
+        now = timezone.now()
+        ttl = settings.IDEMPOTENCY_KEY_TTL
+        request_hash = hashlib.sha256(request.body).hexdigest()
+
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=request.user,
+                    key=key,
+                    path=request.path,
+                    request_hash=request_hash,
+                    expires_at=now + ttl
+                )
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            if record is None:
+                # Purged between our insert and lookup; just run the request
+                return view(request, *args, **kwargs)
+
+            if record.expires_at <= now:
+                # Stale key: reuse the row for this request
+                record.path = request.path
+                record.request_hash = request_hash
+                record.response_status = None
+                record.response_body = None
+                record.expires_at = now + ttl
+                record.save()
+            else:
+                return replay(record, request, request_hash)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        # Server errors are not final; let the client retry them for real
+        if response.status_code >= 500:
+            record.delete()
+            return response
+
+        record.response_status = response.status_code
+        record.response_body = response.data
+        record.save(update_fields=["response_status", "response_body"])
+        return response
+
+    return wrapper
+
+
+def replay(record, request, request_hash):
+    # Rows stored before bodies were hashed have no hash to compare
+    if record.path != request.path or (record.request_hash and record.request_hash != request_hash):
+        return Response(
+            {"error": "Idempotency-Key was already used for a different request"},
+            status=422
+        )
+
+    if record.response_status is None:
+        return Response(
+            {"error": "A request with this Idempotency-Key is still in progress"},
+            status=409
+        )
+
+    response = Response(record.response_body, status=record.response_status)
+    response["Idempotent-Replayed"] = "true"
+    return response
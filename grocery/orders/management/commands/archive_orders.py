@@ -0,0 +1,25 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from orders.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = "Move old orders into the archive tables in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=None,
+            help="Archive orders older than this many days (default: ORDER_ARCHIVE_AFTER)"
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options["days"] is not None:
+            horizon = timedelta(days=options["days"])
+        else:
+            horizon = settings.ORDER_ARCHIVE_AFTER
+
+        moved = archive_orders(timezone.now() - horizon, batch_size=options["batch_size"])
+        self.stdout.write(f"Archived {moved} orders")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from orders.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete expired Idempotency-Key records in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        now = timezone.now()
+        total = 0
+
+        # Small id-based batches keep each DELETE short so it never holds
+        # locks long enough to stall checkouts.
+        while True:
+            ids = list(
+                IdempotencyKey.objects.filter(expires_at__lte=now)
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            IdempotencyKey.objects.filter(id__in=ids).delete()
+            total += len(ids)
+
+        self.stdout.write(f"Purged {total} expired idempotency keys")
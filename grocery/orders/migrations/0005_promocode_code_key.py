@@ -0,0 +1,65 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def fill_code_key(apps, schema_editor):
+    PromoCode = apps.get_model('orders', 'PromoCode')
+    promos = list(PromoCode.objects.values_list('id', 'code'))
+
+    # Codes that only differ by case/whitespace can't share the unique key;
+    # which one to keep is a business decision, so stop before writing
+    codes_by_key = defaultdict(list)
+    for promo_id, code in promos:
+        codes_by_key[code.strip().upper()].append(code)
+    clashes = [codes for codes in codes_by_key.values() if len(codes) > 1]
+    if clashes:
+        raise RuntimeError(
+            "Promo codes differing only by case or surrounding spaces: "
+            + "; ".join(", ".join(repr(code) for code in codes) for codes in clashes)
+            + ". Rename or delete all but one of each group, then migrate again."
+        )
+
+    for promo_id, code in promos:
+        PromoCode.objects.filter(id=promo_id).update(code_key=code.strip().upper())
+
+
+def dedupe_promo_usage(apps, schema_editor):
+    PromoUsage = apps.get_model('orders', 'PromoUsage')
+    duplicates = (
+        PromoUsage.objects.values('user_id', 'promo_id')
+        .annotate(first_id=Min('id'), rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for row in duplicates:
+        PromoUsage.objects.filter(
+            user_id=row['user_id'], promo_id=row['promo_id']
+        ).exclude(id=row['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_idempotencykey'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='promocode',
+            name='code_key',
+            field=models.CharField(editable=False, max_length=50, null=True),
+        ),
+        migrations.RunPython(fill_code_key, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='promocode',
+            name='code_key',
+            field=models.CharField(editable=False, max_length=50, unique=True),
+        ),
+        migrations.RunPython(dedupe_promo_usage, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='promousage',
+            unique_together={('user', 'promo')},
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from users.models import User
 from products.models import Product
 
@@ -7,6 +8,12 @@ class Order(models.Model):
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # order history keyset pagination
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} - {self.user.username}"
 
@@ -19,10 +26,48 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.product.name} x {self.quantity}"
-    
+
+
+# Cold storage for orders older than ORDER_ARCHIVE_AFTER (see archive_orders).
+# Rows keep their original ids so order numbers stay valid after the move.
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='archived_user_created_idx'),
+            # Readers check whether a date range has archived orders at all
+            models.Index(fields=['created_at'], name='archived_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order #{self.id} - {self.user.username} (archived)"
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.IntegerField()
+
+    def __str__(self):
+        return f"{self.product.name} x {self.quantity}"
+
+
+
+# Canonical form used for promo lookups ("  save10 " -> "SAVE10")
+def normalize_promo_code(code):
+    return code.strip().upper()
+
 
 class PromoCode(models.Model):
     code = models.CharField(max_length=50, unique=True)
+    # normalized copy of code so lookups hit a unique index instead of iexact
+    code_key = models.CharField(max_length=50, unique=True, editable=False)
     
     DISCOUNT_TYPES = (
         ('percent', 'Percent'),
@@ -36,10 +81,38 @@ class PromoCode(models.Model):
     active = models.BooleanField(default=True)
     one_time_use = models.BooleanField(default=False)
 
+    def save(self, *args, **kwargs):
+        self.code_key = normalize_promo_code(self.code)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.code
 
 class PromoUsage(models.Model):
     user = models.ForeignKey("users.User", on_delete=models.CASCADE)
     promo = models.ForeignKey(PromoCode, on_delete=models.CASCADE)
-    used_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    used_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # only one-time-use promos are recorded, so a user can have one row
+        # per promo; checkout relies on this instead of an existence query
+        unique_together = ('user', 'promo')
+
+
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    path = models.CharField(max_length=255)
+    # sha256 of the request body; a retry must send the same body
+    request_hash = models.CharField(max_length=64, default="")
+    # null while the original request is still running
+    response_status = models.IntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key}"
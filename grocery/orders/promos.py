@@ -0,0 +1,84 @@
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from django.core.cache import cache
+from django.utils import timezone
+import uuid
+from . models import PromoCode, normalize_promo_code
+
+# Shared across workers via the Django cache; bumped on every promo write
+PROMO_VERSION_KEY = "promo:version"
+MAX_CACHED_PROMOS = 1000
+
+# Per-process compiled rules: normalized code -> PromoRule (or None for codes
+# that do not exist, so repeated bad codes don't hit the database either)
+_rules = {}
+_rules_version = None
+
+
+@dataclass(frozen=True)
+class PromoRule:
+    id: int
+    code: str
+    discount_type: str
+    discount_value: Decimal
+    min_order_amount: Decimal
+    expiry_date: datetime | None
+    active: bool
+    one_time_use: bool
+
+    def is_expired(self):
+        return self.expiry_date is not None and self.expiry_date < timezone.now()
+
+    def discount_for(self, total):
+        if self.discount_type == "percent":
+            discount = total * self.discount_value / 100
+        else:
+            discount = self.discount_value
+
+        # Discount cannot exceed total
+        return min(discount, total)
+
+
+# Return the PromoRule for a user-entered code, or None if it doesn't exist.
+# Costs one cache read for the version; the database is only hit on a miss
+# (or when the version entry has gone missing from the cache).
+def get_promo_rule(code):
+    global _rules_version
+
+    version = cache.get(PROMO_VERSION_KEY)
+    if version is None:
+        # Never set, or evicted: a write may have happened since the rules
+        # were compiled, so start a new version and drop them
+        cache.add(PROMO_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(PROMO_VERSION_KEY)
+        _rules.clear()
+
+    if version != _rules_version or len(_rules) > MAX_CACHED_PROMOS:
+        _rules.clear()
+        _rules_version = version
+
+    key = normalize_promo_code(code)
+    if key not in _rules:
+        promo = PromoCode.objects.filter(code_key=key).first()
+        _rules[key] = compile_rule(promo) if promo else None
+
+    return _rules[key]
+
+
+def compile_rule(promo):
+    return PromoRule(
+        id=promo.id,
+        code=promo.code,
+        discount_type=promo.discount_type,
+        discount_value=Decimal(promo.discount_value),
+        min_order_amount=Decimal(promo.min_order_amount),
+        expiry_date=promo.expiry_date,
+        active=promo.active,
+        one_time_use=promo.one_time_use,
+    )
+
+
+# Call after any promo write; every worker drops its rules on its next lookup
+def invalidate_promo_cache():
+    cache.set(PROMO_VERSION_KEY, uuid.uuid4().hex, None)
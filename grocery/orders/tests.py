@@ -1,3 +1,360 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from products.models import Category, Product
+from users.models import User
+from . import promos
+from . archive import archive_orders
+from . models import IdempotencyKey, Order, OrderItem, PromoCode, PromoUsage
+from . promos import get_promo_rule, invalidate_promo_cache
 
-# Create your tests here.
+@override_settings(STOCK_RESERVATIONS=False, CART_STORE="database")
+class CheckoutTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="customer", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name="fruit")
+
+    def make_products(self, count, stock=10, price="2.50"):
+        return Product.objects.bulk_create([
+            Product(name=f"product {i}", category=self.category, price=price, stock=stock)
+            for i in range(count)
+        ])
+
+    def fill_cart(self, products, quantity=1):
+        for product in products:
+            response = self.client.post("/cart/add/", {"product_id": product.id, "quantity": quantity}, format="json")
+            self.assertEqual(response.status_code, 200)
+
+    def checkout(self, **data):
+        return self.client.post("/orders/checkout/", data, format="json")
+
+    def test_query_count_does_not_grow_with_cart_lines(self):
+        self.fill_cart(self.make_products(2))
+        with CaptureQueriesContext(connection) as small_cart:
+            self.assertEqual(self.checkout().status_code, 201)
+        small_cart_queries = len(small_cart)
+
+        self.fill_cart(self.make_products(40))
+        with self.assertNumQueries(small_cart_queries):
+            response = self.checkout()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data["items"]), 40)
+        self.assertEqual(OrderItem.objects.filter(order_id=response.data["order_id"]).count(), 40)
+
+    def test_checkout_takes_stock_and_clears_cart(self):
+        apple, pear = self.make_products(2, stock=5)
+        self.fill_cart([apple], quantity=2)
+        self.fill_cart([pear], quantity=5)
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["total_price"], 17.5)
+        self.assertEqual(Product.objects.get(id=apple.id).stock, 3)
+        self.assertEqual(Product.objects.get(id=pear.id).stock, 0)
+        self.assertEqual(self.checkout().data, {"error": "Cart is empty"})
+
+    def assert_rejected(self, response, error, products, stock):
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"error": error})
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(
+            list(Product.objects.filter(id__in=[p.id for p in products]).values_list("stock", flat=True)),
+            stock
+        )
+
+    def test_not_enough_stock_writes_nothing(self):
+        products = self.make_products(3, stock=4)
+        self.fill_cart(products, quantity=3)
+        Product.objects.filter(id=products[2].id).update(stock=2)
+
+        response = self.checkout()
+
+        self.assert_rejected(response, "Not enough stock for product 2", products, [4, 4, 2])
+
+    def test_invalid_promo_writes_nothing(self):
+        products = self.make_products(2, stock=4)
+        self.fill_cart(products)
+
+        response = self.checkout(promo_code="NOPE")
+
+        self.assert_rejected(response, "Invalid promo code", products, [4, 4])
+
+    def test_promo_below_minimum_writes_nothing(self):
+        products = self.make_products(2, stock=4)
+        self.fill_cart(products)
+        PromoCode.objects.create(
+            code="BIG", discount_type="fixed", discount_value=5, min_order_amount=100,
+            expiry_date=timezone.now() + timedelta(days=1)
+        )
+
+        response = self.checkout(promo_code="big")
+
+        self.assert_rejected(response, "Minimum order should be 100.00", products, [4, 4])
+
+    def test_used_one_time_promo_writes_nothing(self):
+        products = self.make_products(2, stock=4)
+        self.fill_cart(products)
+        promo = PromoCode.objects.create(
+            code="ONCE", discount_type="fixed", discount_value=1, one_time_use=True,
+            expiry_date=timezone.now() + timedelta(days=1)
+        )
+        PromoUsage.objects.create(user=self.user, promo=promo)
+
+        response = self.checkout(promo_code="ONCE")
+
+        self.assert_rejected(response, "Promo already used", products, [4, 4])
+        self.assertEqual(PromoUsage.objects.count(), 1)
+
+
+class OrderHistoryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="customer", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        # Five orders, two sharing a timestamp so the cursor needs the id
+        start = timezone.now() - timedelta(days=10)
+        self.orders = []
+        for day in (0, 1, 1, 2, 3):
+            order = Order.objects.create(user=self.user, total_price=day + 1)
+            Order.objects.filter(id=order.id).update(created_at=start + timedelta(days=day))
+            self.orders.append(order.id)
+
+        other = User.objects.create_user(username="other", password="x")
+        Order.objects.create(user=other, total_price=1)
+
+    def pages(self, limit, **params):
+        ids = []
+        url = f"/orders/?limit={limit}"
+        for key, value in params.items():
+            url += f"&{key}={value}"
+
+        response = self.client.get(url)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data["results"]), limit)
+            ids += [order["order_id"] for order in response.data["results"]]
+            if response.data["next"] is None:
+                return ids
+            response = self.client.get(f"{url}&cursor={response.data['next']}")
+
+    def test_cursor_walks_every_order_newest_first(self):
+        expected = [self.orders[4], self.orders[3], self.orders[2], self.orders[1], self.orders[0]]
+        for limit in (1, 2, 5, 10):
+            self.assertEqual(self.pages(limit), expected)
+
+    def test_page_queries_do_not_grow_with_limit(self):
+        with CaptureQueriesContext(connection) as one_order:
+            self.client.get("/orders/?limit=1")
+        one_order_queries = len(one_order)
+
+        with self.assertNumQueries(one_order_queries):
+            self.client.get("/orders/?limit=5")
+
+    def test_archived_orders_are_merged_in_order(self):
+        archive_orders(timezone.now() - timedelta(days=8, hours=12))
+
+        self.assertEqual(self.pages(2), [self.orders[4], self.orders[3]])
+        self.assertEqual(self.pages(2, include_archive="true"), self.orders[::-1])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/orders/?cursor=not-a-cursor")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"error": "Invalid cursor"})
+
+
+class IdempotencyTests(TestCase):
+
+    def setUp(self):
+        self.manager = User.objects.create_user(username="manager", password="x", role="manager")
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def create_promo(self, key, code="SAVE10"):
+        return self.client.post(
+            "/orders/promo/create/",
+            {"code": code, "discount_type": "percent", "discount_value": 10, "expiry_date": "2099-01-01T00:00:00"},
+            format="json",
+            HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_the_first_response(self):
+        first = self.create_promo("key-1")
+        retry = self.create_promo("key-1")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(PromoCode.objects.count(), 1)
+
+    def test_key_reused_with_a_different_body(self):
+        self.create_promo("key-1")
+        response = self.create_promo("key-1", code="OTHER")
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(PromoCode.objects.filter(code="OTHER").exists())
+
+    def test_keys_are_per_user(self):
+        self.create_promo("key-1")
+        other = User.objects.create_user(username="other", password="x", role="manager")
+        self.client.force_authenticate(other)
+
+        response = self.create_promo("key-1", code="OTHER")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
+
+    def test_expired_key_runs_again(self):
+        self.create_promo("key-1")
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.create_promo("key-1", code="OTHER")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(PromoCode.objects.count(), 2)
+
+    def test_without_a_key_every_request_runs(self):
+        self.create_promo("")
+        response = self.create_promo("")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"error": "A promo code with this code already exists"})
+
+
+class PromoRuleCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        promos._rules.clear()
+        promos._rules_version = None
+        self.promo = PromoCode.objects.create(code="SAVE", discount_type="percent", discount_value=10)
+
+    def test_write_drops_compiled_rules(self):
+        self.assertTrue(get_promo_rule("save").active)
+
+        PromoCode.objects.filter(id=self.promo.id).update(active=False)
+        invalidate_promo_cache()
+
+        self.assertFalse(get_promo_rule("save").active)
+
+    def test_lost_version_drops_compiled_rules(self):
+        self.assertTrue(get_promo_rule("save").active)
+
+        # The write's version bump was evicted before this worker saw it
+        PromoCode.objects.filter(id=self.promo.id).update(active=False)
+        invalidate_promo_cache()
+        cache.delete(promos.PROMO_VERSION_KEY)
+
+        self.assertFalse(get_promo_rule("save").active)
+        with self.assertNumQueries(0):
+            get_promo_rule("save")
+
+
+@override_settings(STOCK_RESERVATIONS=False)
+class BulkOrderTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="buyer", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="fruit")
+        self.apple, self.pear = Product.objects.bulk_create([
+            Product(name="apple", category=category, price="2.00", stock=5),
+            Product(name="pear", category=category, price="3.00", stock=2),
+        ])
+
+    def stock(self):
+        return dict(Product.objects.values_list("name", "stock"))
+
+    def post(self, orders, **extra):
+        return self.client.post("/orders/bulk/", orders, format="json", **extra)
+
+    def test_orders_are_allocated_in_submission_order(self):
+        response = self.post([
+            {"reference": "a", "items": [{"product_id": self.apple.id, "quantity": 3}]},
+            {"reference": "b", "items": [{"product_id": self.apple.id, "quantity": 3}]},
+            {"reference": "c", "items": [{"product_id": self.apple.id, "quantity": 2}, {"product_id": self.pear.id}]},
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data["created"], response.data["rejected"]), (2, 1))
+        self.assertEqual([r["status"] for r in response.data["results"]], ["created", "rejected", "created"])
+        self.assertEqual(response.data["results"][1]["error"], "Not enough stock for apple")
+        self.assertEqual(response.data["results"][2]["total_price"], 7.0)
+        self.assertEqual(self.stock(), {"apple": 0, "pear": 1})
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(OrderItem.objects.count(), 3)
+
+    def test_invalid_entries_are_rejected_one_by_one(self):
+        response = self.post([
+            {"reference": "no items", "items": []},
+            {"reference": "unknown", "items": [{"product_id": 999}]},
+            {"reference": "bad quantity", "items": [{"product_id": self.pear.id, "quantity": 0}]},
+            "not an order",
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["created"], 0)
+        self.assertEqual(
+            [r["error"] for r in response.data["results"]],
+            [
+                "Order must have a non-empty items list",
+                "Product 999 not found",
+                "Quantity must be at least 1",
+                "Order must have a non-empty items list",
+            ]
+        )
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), {"apple": 5, "pear": 2})
+
+    def test_stock_race_rolls_the_batch_back(self):
+        with mock.patch("orders.views.decrement_stock", return_value=False):
+            response = self.post([{"items": [{"product_id": self.apple.id}]}])
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(self.stock(), {"apple": 5, "pear": 2})
+
+    def test_jsonl_body_with_idempotency_key(self):
+        body = "\n".join([
+            json.dumps({"reference": "a", "items": [{"product_id": self.apple.id, "quantity": 2}]}),
+            "",
+            json.dumps({"reference": "b", "items": [{"product_id": self.pear.id, "quantity": 2}]}),
+        ])
+
+        def post():
+            return self.client.generic(
+                "POST", "/orders/bulk/", body, content_type="application/x-ndjson", HTTP_IDEMPOTENCY_KEY="batch-1"
+            )
+
+        first = post()
+        retry = post()
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.data["created"], 2)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(self.stock(), {"apple": 3, "pear": 0})
+
+    def test_bad_payloads(self):
+        self.assertEqual(self.post([]).data, {"error": "No orders given"})
+        self.assertEqual(self.post({"orders": "x"}).data, {"error": "Expected a list of orders"})
+        response = self.client.generic("POST", "/orders/bulk/", "{nope", content_type="application/jsonl")
+        self.assertEqual(response.data, {"error": "Invalid JSONL body"})
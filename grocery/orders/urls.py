@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path('checkout/', views.checkout),
+    path('bulk/', views.bulk_orders),
     path('', views.order_list),
    # Promo APIs
     path('promo/create/', views.create_promo),
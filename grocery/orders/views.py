@@ -2,157 +2,424 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from cart.models import Cart, CartItem
+from cart.models import Cart
+from cart.stores import get_cart_store
+from cart.reservations import held_quantities, reservations_enabled, reserved_quantities
 from products.models import Product
-from . models import Order, OrderItem, PromoCode, PromoUsage
-from django.utils import timezone
+from products.cache import invalidate_product_cache
+from products.counters import record_popularity
+from products.renderers import RowRenderer, line_total, to_float
+from products.trending import trending_increment
+from . models import Order, OrderItem, PromoCode, PromoUsage, normalize_promo_code
+from . archive import order_tables
+from . idempotency import idempotent
+from . promos import get_promo_rule, invalidate_promo_cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, Q, When
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+import base64
+import binascii
+import json
 
 
 # CHECKOUT with Promo Code Support
+# Runs as one transaction with a constant number of queries: the cart lines,
+# one locked fetch of their products, one guarded stock update and one
+# bulk insert of order items. Nothing is written unless every check passes.
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def checkout(request):
     user = request.user
 
     # OPTIONAL PROMO CODE
     promo_code_input = request.data.get("promo_code")
 
-    # Get cart
-    try:
-        cart = Cart.objects.get(user=user)
-    except Cart.DoesNotExist:
-        return Response({"error": "Cart is empty"}, status=400)
+    store = get_cart_store()
 
-    items = CartItem.objects.filter(cart=cart)
-    if not items.exists():
-        return Response({"error": "No items in cart"}, status=400)
+    with transaction.atomic():
+        # product_id -> quantity for every cart line
+        lines = store.get_lines(user)
+        if not lines:
+            return Response({"error": "Cart is empty"}, status=400)
 
-    # Create order (final total will be updated later)
-    order = Order.objects.create(user=user, total_price=0)
-    total_price = 0
-    order_items_detail = []
+        # Lock all cart products in one query (ordered by id to avoid deadlocks)
+        products = Product.objects.select_for_update().filter(id__in=lines).order_by("id")
+        products = {p.id: p for p in products}
 
-    # Loop through cart items
-    for item in items:
-        product = item.product
+        # Reservation mode: lines with a live hold are already covered; the
+        # rest may only use stock that other carts haven't reserved
+        held_by_others = {}
+        if reservations_enabled():
+            cart_id = Cart.objects.filter(user=user).values_list("id", flat=True).first()
+            held = held_quantities(cart_id)
+            unreserved = [pid for pid, quantity in lines.items() if held.get(pid, 0) < quantity]
+            if unreserved:
+                held_by_others = reserved_quantities(unreserved, exclude_cart=cart_id)
 
         # Stock Check
-        if product.stock < item.quantity:
-            return Response(
-                {"error": f"Not enough stock for {product.name}"},
-                status=400
-            )
+        for product_id, quantity in lines.items():
+            product = products.get(product_id)
+            if product is None:
+                return Response({"error": "Product no longer available"}, status=400)
+            if product.stock - held_by_others.get(product_id, 0) < quantity:
+                return Response(
+                    {"error": f"Not enough stock for {product.name}"},
+                    status=400
+                )
 
-        # Create OrderItem
-        OrderItem.objects.create(
-            order=order,
-            product=product,
-            price=product.price,
-            quantity=item.quantity
+        # Bill total
+        total_price = sum(
+            (products[pid].price * quantity for pid, quantity in lines.items()),
+            Decimal("0")
         )
 
-        # Reduce stock + increase popularity
-        product.stock -= item.quantity
-        product.popularity += item.quantity
-        product.save()
+        # APPLY PROMO CODE
+        discount_applied = Decimal("0")
+        promo = None
+
+        if promo_code_input:  # If user entered a promo code
+            promo = get_promo_rule(promo_code_input)
+            if promo is None or not promo.active:
+                return Response({"error": "Invalid promo code"}, status=400)
+
+            # Expiry Check
+            if promo.is_expired():
+                return Response({"error": "Promo code expired"}, status=400)
+
+            # Minimum order amount check
+            if total_price < promo.min_order_amount:
+                return Response(
+                    {"error": f"Minimum order should be {promo.min_order_amount}"},
+                    status=400
+                )
+
+            # Discount Calculation
+            discount_applied = promo.discount_for(total_price)
+
+            # One-time use: the unique (user, promo) row is the check itself
+            if promo.one_time_use:
+                try:
+                    with transaction.atomic():
+                        PromoUsage.objects.create(user=user, promo_id=promo.id)
+                except IntegrityError:
+                    return Response({"error": "Promo already used"}, status=400)
+
+        # Reduce stock in one guarded UPDATE
+        if not decrement_stock(lines):
+            # Stock changed underneath us; undo everything
+            transaction.set_rollback(True)
+            return Response({"error": "Not enough stock"}, status=400)
+
+        # Popularity is buffered and folded in later by flush_popularity
+        record_popularity(lines)
+
+        # Stock shown on product pages changed
+        transaction.on_commit(lambda: invalidate_product_cache(list(lines)))
+
+        # Final total
+        final_total = total_price - discount_applied
+
+        # Create order + all its items
+        order = Order.objects.create(user=user, total_price=final_total)
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_id=product_id,
+                price=products[product_id].price,
+                quantity=quantity
+            )
+            for product_id, quantity in lines.items()
+        ])
+
+        # Clear cart (which also consumes its stock reservations)
+        store.clear(user)
+
+    # Add item details
+    order_items_detail = [
+        {
+            "product": products[product_id].name,
+            "price": float(products[product_id].price),
+            "quantity": quantity,
+            "total": float(products[product_id].price * quantity)
+        }
+        for product_id, quantity in lines.items()
+    ]
+
+    # Return final bill
+    return Response({
+        "message": "Checkout successful",
+        "order_id": order.id,
+        "total_price": float(final_total),
+        "discount_applied": float(discount_applied),
+        "items": order_items_detail
+    }, status=201)
 
-        # Bill total
-        total_price += float(product.price * item.quantity)
 
-        # Add item details
-        order_items_detail.append({
-            "product": product.name,
-            "price": float(product.price),
-            "quantity": item.quantity,
-            "total": float(product.price * item.quantity)
-        })
+# Decrement stock for every product_id -> quantity pair in a single UPDATE,
+# which also adds the sale to each product's trending score.
+# Each row is only touched if it still has enough stock, so a short update
+# count means at least one line could not be fulfilled.
+def decrement_stock(lines):
+    guard = Q()
+    stock_cases = []
 
-    # APPLY PROMO CODE
-    discount_applied = 0
+    for product_id, quantity in lines.items():
+        guard |= Q(id=product_id, stock__gte=quantity)
+        stock_cases.append(When(id=product_id, then=F("stock") - quantity))
 
-    if promo_code_input:  # If user entered a promo code
+    updated = Product.objects.filter(guard).update(
+        stock=Case(*stock_cases, default=F("stock")),
+        trending=trending_increment(lines)
+    )
+    return updated == len(lines)
+
+
+
+# BULK ORDERS (B2B / integrations)
+# Accepts a JSON array (or JSONL body) of {"reference": ..., "items": [{"product_id", "quantity"}]}.
+# Every referenced product is locked and checked in one pass, stock for the
+# whole batch goes out in one guarded UPDATE and items in one bulk insert.
+# Each order is all-or-nothing; rejected orders don't block the rest.
+MAX_BULK_ORDERS = 1000
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent
+def bulk_orders(request):
+    user = request.user
+
+    try:
+        payload = parse_bulk_payload(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    if not payload:
+        return Response({"error": "No orders given"}, status=400)
+    if len(payload) > MAX_BULK_ORDERS:
+        return Response({"error": f"At most {MAX_BULK_ORDERS} orders per request"}, status=400)
+
+    results = [None] * len(payload)
+    orders = []  # (index, reference, lines)
+
+    for index, entry in enumerate(payload):
+        reference = entry.get("reference") if isinstance(entry, dict) else None
         try:
-            promo = PromoCode.objects.get(code__iexact=promo_code_input, active=True)
-        except PromoCode.DoesNotExist:
-            return Response({"error": "Invalid promo code"}, status=400)
-
-        # Expiry Check
-        if promo.expiry_date < timezone.now():
-            return Response({"error": "Promo code expired"}, status=400)
-
-        # Minimum order amount check
-        if total_price < float(promo.min_order_amount):
-            return Response(
-                {"error": f"Minimum order should be {promo.min_order_amount}"},
-                status=400
+            orders.append((index, reference, parse_order_lines(entry)))
+        except ValueError as e:
+            results[index] = {"index": index, "reference": reference, "status": "rejected", "error": str(e)}
+
+    with transaction.atomic():
+        product_ids = {pid for _, _, lines in orders for pid in lines}
+
+        # Lock every product in the batch in one query
+        products = Product.objects.select_for_update().filter(id__in=product_ids).order_by("id")
+        products = {p.id: p for p in products}
+
+        # Stock other carts are holding can't be sold here
+        held = reserved_quantities(product_ids) if reservations_enabled() and product_ids else {}
+        available = {pid: p.stock - held.get(pid, 0) for pid, p in products.items()}
+
+        # Allocate in submission order
+        accepted = []
+        allocated = {}
+        for index, reference, lines in orders:
+            error = None
+            for product_id, quantity in lines.items():
+                if product_id not in products:
+                    error = f"Product {product_id} not found"
+                    break
+                if available[product_id] < quantity:
+                    error = f"Not enough stock for {products[product_id].name}"
+                    break
+
+            if error:
+                results[index] = {"index": index, "reference": reference, "status": "rejected", "error": error}
+                continue
+
+            for product_id, quantity in lines.items():
+                available[product_id] -= quantity
+                allocated[product_id] = allocated.get(product_id, 0) + quantity
+
+            total_price = sum(
+                (products[pid].price * quantity for pid, quantity in lines.items()),
+                Decimal("0")
             )
+            accepted.append((index, reference, lines, Order(user=user, total_price=total_price)))
+
+        if accepted:
+            if not decrement_stock(allocated):
+                transaction.set_rollback(True)
+                return Response({"error": "Stock changed during allocation, retry"}, status=409)
+
+            new_orders = [order for _, _, _, order in accepted]
+            if connection.features.can_return_rows_from_bulk_insert:
+                Order.objects.bulk_create(new_orders)
+            else:
+                # MySQL doesn't hand back ids from a multi-row INSERT, and
+                # the items need them
+                for order in new_orders:
+                    order.save()
+
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product_id=product_id,
+                    price=products[product_id].price,
+                    quantity=quantity
+                )
+                for _, _, lines, order in accepted
+                for product_id, quantity in lines.items()
+            ])
+
+            record_popularity(allocated)
+            transaction.on_commit(lambda: invalidate_product_cache(list(allocated)))
+
+    for index, reference, lines, order in accepted:
+        results[index] = {
+            "index": index,
+            "reference": reference,
+            "status": "created",
+            "order_id": order.id,
+            "total_price": float(order.total_price)
+        }
 
-        # One-time use check
-        if promo.one_time_use:
-            if PromoUsage.objects.filter(user=user, promo=promo).exists():
-                return Response({"error": "Promo already used"}, status=400)
+    return Response({
+        "created": len(accepted),
+        "rejected": len(payload) - len(accepted),
+        "results": results
+    }, status=201 if accepted else 400)
 
-        # Discount Calculation
-        if promo.discount_type == "percent":
-            discount_applied = total_price * float(promo.discount_value) / 100
-        else:
-            discount_applied = float(promo.discount_value)
 
-        # Discount cannot exceed total
-        discount_applied = min(discount_applied, total_price)
+# List of order dicts from a JSON array, {"orders": [...]} or a JSONL body
+def parse_bulk_payload(request):
+    if request.content_type.split(";")[0].strip() in ("application/x-ndjson", "application/jsonl"):
+        try:
+            return [json.loads(line) for line in request.body.decode().splitlines() if line.strip()]
+        except (UnicodeError, json.JSONDecodeError):
+            raise ValueError("Invalid JSONL body")
 
-        # Save promo usage (only if one-time-use)
-        if promo.one_time_use:
-            PromoUsage.objects.create(user=user, promo=promo)
+    data = request.data
+    if isinstance(data, dict):
+        data = data.get("orders")
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of orders")
+    return data
 
-    # Final total
-    final_total = total_price - discount_applied
 
-    # Update order amount
-    order.total_price = final_total
-    order.save()
+# product_id -> quantity for one bulk order entry (duplicate lines merged)
+def parse_order_lines(entry):
+    if not isinstance(entry, dict) or not isinstance(entry.get("items"), list) or not entry["items"]:
+        raise ValueError("Order must have a non-empty items list")
 
-    # Clear cart
-    items.delete()
+    lines = {}
+    for line in entry["items"]:
+        try:
+            product_id = int(line["product_id"])
+            quantity = int(line.get("quantity", 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValueError("Each item needs a numeric product_id and quantity")
+        if quantity < 1:
+            raise ValueError("Quantity must be at least 1")
+        lines[product_id] = lines.get(product_id, 0) + quantity
+    return lines
 
-    # Return final bill
-    return Response({
-        "message": "Checkout successful",
-        "order_id": order.id,
-        "total_price": final_total,
-        "discount_applied": discount_applied,
-        "items": order_items_detail
-    }, status=201)
 
 
+# ORDER HISTORY (paginated, newest first)
+# Keyset pagination on (created_at, id): each page is an index range scan on
+# (user, created_at, id) no matter how many orders the user has, and the
+# items + products for the whole page come from two prefetch queries.
+ORDER_PAGE_SIZE = 20
+MAX_ORDER_PAGE_SIZE = 100
+
 
-# ORDER HISTORY (All orders)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def order_list(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    data = []
-
-    for order in orders:
-        order_items = OrderItem.objects.filter(order=order)
-        items_data = [
-            {
-                "product": item.product.name,
-                "quantity": item.quantity,
-                "price": float(item.price),
-                "total": float(item.price * item.quantity)
-            }
-            for item in order_items
-        ]
-
-        data.append({
-            "order_id": order.id,
-            "total_price": float(order.total_price),
-            "created_at": order.created_at,
-            "items": items_data
-        })
+    try:
+        limit = min(int(request.GET.get("limit", ORDER_PAGE_SIZE)), MAX_ORDER_PAGE_SIZE)
+    except ValueError:
+        return Response({"error": "limit must be a number"}, status=400)
+    if limit < 1:
+        return Response({"error": "limit must be positive"}, status=400)
+
+    cursor = request.GET.get("cursor")
+    if cursor:
+        try:
+            created_at, last_id = decode_cursor(cursor)
+        except ValueError:
+            return Response({"error": "Invalid cursor"}, status=400)
+
+    # Archived orders are only read when asked for
+    include_archive = request.GET.get("include_archive") == "true"
+
+    # Fetch one extra row to know whether there is a next page. With the
+    # archive included, each table yields its own page and they are merged.
+    # Orders and items are read as tuples, two queries per table.
+    page = []
+    items = defaultdict(list)
+    for order_model, item_model in order_tables(include_archive):
+        orders = order_model.objects.filter(user=request.user).order_by('-created_at', '-id')
+        if cursor:
+            orders = orders.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=last_id)
+            )
+        rows = list(orders.values_list(*ORDER_RENDERER.columns)[:limit + 1])
+        page += rows
 
-    return Response(data)
+        item_rows = (
+            item_model.objects.filter(order_id__in=[row[0] for row in rows])
+            .order_by("id").values_list("order_id", *ORDER_ITEM_RENDERER.columns)
+        )
+        for order_id, *item_row in item_rows:
+            items[order_id].append(item_row)
+
+    page.sort(key=lambda row: (row[2], row[0]), reverse=True)
+    page = page[:limit + 1]
+    has_next = len(page) > limit
+    page = page[:limit]
+
+    data = ORDER_RENDERER(page)
+    for order, row in zip(data, page):
+        order["items"] = ORDER_ITEM_RENDERER(items[row[0]])
+
+    next_cursor = encode_cursor(page[-1][2], page[-1][0]) if has_next else None
+
+    return Response({"next": next_cursor, "results": data})
+
+
+# Columns in this order: the merge above sorts on (created_at, id)
+ORDER_RENDERER = RowRenderer(
+    ("order_id", "id"),
+    ("total_price", "total_price", to_float),
+    ("created_at", "created_at"),
+)
+
+ORDER_ITEM_RENDERER = RowRenderer(
+    ("product", "product__name"),
+    ("quantity", "quantity"),
+    ("price", "price", to_float),
+    ("total", ("price", "quantity"), line_total),
+)
+
+
+# Opaque "<created_at>|<id>" token so clients never build cursors themselves
+def encode_cursor(created_at, last_id):
+    raw = f"{created_at.isoformat()}|{last_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, last_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(last_id)
+    except (binascii.Error, UnicodeError, TypeError):
+        raise ValueError("Invalid cursor")
 
 
 
@@ -163,6 +430,7 @@ def is_manager(user):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_promo(request):
 
     if not is_manager(request.user):
@@ -175,7 +443,7 @@ def create_promo(request):
         if field not in data:
             return Response({"error": f"{field} is required"}, status=400)
 
-    promo = PromoCode.objects.create(
+    promo = PromoCode(
         code=data["code"],
         discount_type=data["discount_type"],
         discount_value=data["discount_value"],
@@ -184,10 +452,28 @@ def create_promo(request):
         active=data.get("active", True),
         one_time_use=data.get("one_time_use", False)
     )
+    if not save_promo(promo):
+        return Response({"error": "A promo code with this code already exists"}, status=400)
+    invalidate_promo_cache()
 
     return Response({"message": "Promo code created", "code": promo.code}, status=201)
 
 
+# Codes are unique ignoring case and surrounding spaces (code_key); False
+# when another promo already has this one
+def save_promo(promo):
+    clash = PromoCode.objects.filter(code_key=normalize_promo_code(promo.code)).exclude(id=promo.id)
+    if clash.exists():
+        return False
+    try:
+        # savepoint, so a racing insert doesn't break an outer transaction
+        with transaction.atomic():
+            promo.save()
+    except IntegrityError:
+        return False
+    return True
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_promos(request):
@@ -215,6 +501,7 @@ def list_promos(request):
 
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def update_promo(request, id):
 
     if not is_manager(request.user):
@@ -235,13 +522,16 @@ def update_promo(request, id):
     promo.active = data.get("active", promo.active)
     promo.one_time_use = data.get("one_time_use", promo.one_time_use)
 
-    promo.save()
+    if not save_promo(promo):
+        return Response({"error": "A promo code with this code already exists"}, status=400)
+    invalidate_promo_cache()
 
     return Response({"message": "Promo updated successfully"})
 
 
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def delete_promo(request, id):
 
     if not is_manager(request.user):
@@ -253,5 +543,6 @@ def delete_promo(request, id):
         return Response({"error": "Promo code not found"}, status=404)
 
     promo.delete()
+    invalidate_promo_cache()
     return Response({"message": "Promo deleted"})
 
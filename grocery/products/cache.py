@@ -0,0 +1,113 @@
+import hashlib
+import time
+import uuid
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.http import parse_etags, quote_etag, urlencode
+from rest_framework.renderers import JSONRenderer
+from . locks import acquire_lock, release_lock
+
+# Public product GETs are cached as rendered JSON under keys that embed a
+# version: the catalog version for list pages, the product's own version
+# for detail pages. Writes bump versions instead of hunting down keys.
+CATALOG_VERSION_KEY = "products:version"
+PRODUCT_VERSION_KEY = "products:version:{}"
+# Part of every detail key; bumped by bulk writes to expire all detail pages at once
+ALL_PRODUCTS_VERSION_KEY = "products:version:all"
+
+# How long concurrent misses wait for the first one to fill the cache
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2.0
+LOCK_POLL = 0.05
+
+
+def catalog_version(request, **kwargs):
+    return cache.get(CATALOG_VERSION_KEY, "0")
+
+
+def product_version(request, pk, **kwargs):
+    keys = [ALL_PRODUCTS_VERSION_KEY, PRODUCT_VERSION_KEY.format(pk)]
+    versions = cache.get_many(keys)
+    return ":".join(versions.get(key, "0") for key in keys)
+
+
+# Call after any write that changes what product endpoints return. List
+# pages always go stale; detail pages only for the given product ids, or
+# for every product with all_products=True (bulk writes).
+def invalidate_product_cache(product_ids=(), all_products=False):
+    versions = {CATALOG_VERSION_KEY: uuid.uuid4().hex}
+    if all_products:
+        versions[ALL_PRODUCTS_VERSION_KEY] = uuid.uuid4().hex
+    else:
+        for product_id in product_ids:
+            versions[PRODUCT_VERSION_KEY.format(product_id)] = uuid.uuid4().hex
+    cache.set_many(versions, None)
+
+
+# Cache successful GET responses of a DRF function view. Must sit below
+# @api_view. `version` picks the version the cache key is tied to; `params`
+# are the query parameters the view reads. Only those go into the key, so
+# junk parameters can't fill the cache with copies of the same page.
+# Responses get a strong ETag (hash of the body) and If-None-Match gets a
+# 304; concurrent misses on one key wait for a single recomputation.
+def cache_product_response(version, params=()):
+
+    def decorator(view):
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET":
+                return view(request, *args, **kwargs)
+
+            query = urlencode([(name, request.GET[name]) for name in params if name in request.GET])
+            path_hash = hashlib.md5(f"{request.path}?{query}".encode()).hexdigest()
+            key = f"products:page:{version(request, **kwargs)}:{path_hash}"
+
+            entry = cache.get(key)
+            if entry is None:
+                entry = fill(key, lambda: view(request, *args, **kwargs))
+                if not isinstance(entry, tuple):
+                    # Error responses aren't cached; hand it back as is
+                    return entry
+
+            etag, content = entry
+            if etag in parse_etags(request.headers.get("If-None-Match", "")):
+                response = HttpResponse(status=304)
+            else:
+                response = HttpResponse(content, content_type="application/json")
+            response["ETag"] = etag
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+# Compute the entry for `key` once even if many requests miss together:
+# the first takes a short lock (see products.locks) and renders, the rest
+# poll for its result.
+def fill(key, compute):
+    token = acquire_lock(key, LOCK_TIMEOUT)
+
+    if token is None:
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+
+    try:
+        response = compute()
+        if response.status_code != 200:
+            return response
+
+        content = JSONRenderer().render(response.data)
+        entry = (quote_etag(hashlib.sha256(content).hexdigest()), content)
+        cache.set(key, entry, settings.PRODUCT_CACHE_TIMEOUT)
+        return entry
+    finally:
+        if token is not None:
+            release_lock(key, token)
@@ -0,0 +1,33 @@
+from django.db.models import Case, Count, F, IntegerField, Subquery, OuterRef, Value, When
+from django.db.models.functions import Coalesce
+from . models import Category, Product
+
+
+# Category for a user-supplied name, created on first use
+def get_or_create_category(name):
+    name = name.strip()
+    category = Category.objects.filter(name__iexact=name).first()
+    if category is None:
+        category, created = Category.objects.get_or_create(name=name)
+    return category
+
+
+# Apply {category_id: +n / -n} to the product counters in one UPDATE
+def adjust_category_counts(changes):
+    changes = {category_id: delta for category_id, delta in changes.items() if delta}
+    if not changes:
+        return
+
+    Category.objects.filter(id__in=changes).update(
+        product_count=Case(
+            *[When(id=category_id, then=F("product_count") + delta) for category_id, delta in changes.items()],
+            default=F("product_count"),
+            output_field=IntegerField()
+        )
+    )
+
+
+# Recompute every counter from the products table (repair / after bulk loads)
+def recount_categories():
+    counts = Product.objects.filter(category=OuterRef("pk")).values("category").annotate(n=Count("id")).values("n")
+    Category.objects.update(product_count=Coalesce(Subquery(counts), Value(0)))
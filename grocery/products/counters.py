@@ -0,0 +1,61 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Case, F, Max, When
+from . cache import invalidate_product_cache
+from . models import PopularityDelta, Product
+
+FLUSH_CHUNK_SIZE = 500
+
+
+# Queue popularity increments for product_id -> quantity pairs (one INSERT)
+def record_popularity(lines):
+    PopularityDelta.objects.bulk_create([
+        PopularityDelta(product_id=product_id, quantity=quantity)
+        for product_id, quantity in lines.items()
+    ])
+
+
+# Fold pending deltas into Product.popularity, batch_size at a time. Each
+# batch locks the delta rows it reads, adds them up and deletes exactly
+# those rows, so a checkout still committing a delta while this runs is
+# left for the next flush rather than deleted uncounted. Only rows up to
+# the max id at the start are read, so a busy shop can't keep it running.
+def flush_popularity(batch_size=5000):
+    max_id = PopularityDelta.objects.aggregate(max_id=Max("id"))["max_id"]
+    if max_id is None:
+        return 0
+
+    updated = set()
+    while True:
+        with transaction.atomic():
+            rows = list(
+                PopularityDelta.objects.select_for_update()
+                .filter(id__lte=max_id).order_by("id")
+                .values_list("id", "product_id", "quantity")[:batch_size]
+            )
+
+            totals = defaultdict(int)
+            for delta_id, product_id, quantity in rows:
+                totals[product_id] += quantity
+
+            product_ids = sorted(totals)
+            for start in range(0, len(product_ids), FLUSH_CHUNK_SIZE):
+                chunk = product_ids[start:start + FLUSH_CHUNK_SIZE]
+                Product.objects.filter(id__in=chunk).update(
+                    popularity=Case(
+                        *[When(id=product_id, then=F("popularity") + totals[product_id]) for product_id in chunk],
+                        default=F("popularity")
+                    )
+                )
+
+            PopularityDelta.objects.filter(id__in=[row[0] for row in rows]).delete()
+
+        updated.update(product_ids)
+        if len(rows) < batch_size:
+            break
+
+    # popular=true listings are ordered by this column
+    if updated:
+        invalidate_product_cache(list(updated))
+
+    return len(updated)
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+
+# Short locks shared by every worker, kept with the cache entries they
+# guard. Where cache.add() is atomic (memcached, Redis, locmem) it is the
+# lock. FileBasedCache checks and writes separately, so there the lock is a
+# file created with O_CREAT | O_EXCL in the cache directory, which only one
+# process can create. A lock left by a crashed worker is taken over once it
+# is older than its timeout.
+LOCK_POLL = 0.05
+
+
+class LockTimeout(Exception):
+    pass
+
+
+# Take the lock for `key` without waiting: a token for release_lock(), or
+# None if someone else holds it
+def acquire_lock(key, timeout, alias="default"):
+    cache = caches[alias]
+    token = uuid.uuid4().hex
+
+    if not isinstance(cache, FileBasedCache):
+        return token if cache.add(f"lock:{key}", token, timeout) else None
+
+    path = lock_path(cache, key)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        try:
+            stale = time.time() - os.path.getmtime(path) > timeout
+        except FileNotFoundError:
+            # Released in the meantime; the caller can try again
+            return None
+        if not stale:
+            return None
+        try:
+            os.remove(path)
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except (FileNotFoundError, FileExistsError):
+            # Another worker took it over first
+            return None
+
+    with os.fdopen(fd, "w") as lock_file:
+        lock_file.write(token)
+    return token
+
+
+# Release a lock taken with acquire_lock(), unless it has since expired and
+# been taken over by someone else
+def release_lock(key, token, alias="default"):
+    cache = caches[alias]
+
+    if not isinstance(cache, FileBasedCache):
+        if cache.get(f"lock:{key}") == token:
+            cache.delete(f"lock:{key}")
+        return
+
+    path = lock_path(cache, key)
+    try:
+        with open(path) as lock_file:
+            if lock_file.read() != token:
+                return
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Hold the lock for `key` around a block, waiting up to `wait` seconds for
+# it; LockTimeout if it doesn't come free
+@contextmanager
+def cache_lock(key, timeout, wait, alias="default"):
+    deadline = time.monotonic() + wait
+    while True:
+        token = acquire_lock(key, timeout, alias)
+        if token is not None:
+            break
+        if time.monotonic() >= deadline:
+            raise LockTimeout(key)
+        time.sleep(LOCK_POLL)
+
+    try:
+        yield
+    finally:
+        release_lock(key, token, alias)
+
+
+def lock_path(cache, key):
+    # Not a .djcache file, so culling and clear() leave it alone
+    os.makedirs(cache._dir, exist_ok=True)
+    return os.path.join(cache._dir, hashlib.md5(key.encode()).hexdigest() + ".lock")
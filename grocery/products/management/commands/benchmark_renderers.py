@@ -0,0 +1,70 @@
+from decimal import Decimal
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from products.models import Category, Product
+from products.renderers import product_renderer
+from products.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare ProductSerializer with the values_list() row renderer on in-memory rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        renderer = product_renderer()
+        categories = [Category(id=i, name=f"category {i}") for i in range(1, 21)]
+
+        # The same products as values_list() tuples and as the row values
+        # Product.from_db() hydrates, so neither side touches the database
+        rows = []
+        for i in range(1, options["rows"] + 1):
+            rows.append({
+                "id": i,
+                "sku": f"SKU-{i}",
+                "name": f"Product {i}",
+                "category__name": categories[i % 20].name,
+                "price": Decimal(i % 5000) / 100,
+                "stock": i % 300,
+                "image_url": None,
+                "popularity": i % 97,
+            })
+
+        field_names = ["id", "sku", "name", "category_id", "price", "stock", "image_url", "popularity", "trending"]
+        model_rows = [
+            [row["id"], row["sku"], row["name"], categories[row["id"] % 20].id, row["price"], row["stock"], None, row["popularity"], 0.0]
+            for row in rows
+        ]
+        tuples = [tuple(row[column] for column in renderer.columns) for row in rows]
+
+        def serializer_path():
+            products = []
+            for values in model_rows:
+                product = Product.from_db("default", field_names, values)
+                product.category = categories[values[0] % 20]
+                products.append(product)
+            return ProductSerializer(products, many=True).data
+
+        def renderer_path():
+            return renderer(tuples)
+
+        if [dict(item) for item in serializer_path()] != renderer_path():
+            raise CommandError("Renderer output differs from ProductSerializer")
+
+        serializer_time = self.best_of(serializer_path, options["repeat"])
+        renderer_time = self.best_of(renderer_path, options["repeat"])
+
+        self.stdout.write(f"{options['rows']} rows, best of {options['repeat']}")
+        self.stdout.write(f"  ProductSerializer: {serializer_time * 1000:.1f} ms")
+        self.stdout.write(f"  row renderer:      {renderer_time * 1000:.1f} ms")
+        self.stdout.write(f"  speed-up:          {serializer_time / renderer_time:.1f}x")
+
+    def best_of(self, fn, repeat):
+        times = []
+        for _ in range(repeat):
+            start = perf_counter()
+            fn()
+            times.append(perf_counter() - start)
+        return min(times)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from products.transfer import FORMATS, export_products
+
+
+class Command(BaseCommand):
+    help = "Stream the product catalog as CSV or JSONL to a file (default stdout)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument("--output", default="-")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunks = export_products(options["format"], options["chunk_size"])
+
+        if options["output"] == "-":
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+
+        with open(options["output"], "w", newline="", encoding="utf-8") as output:
+            for chunk in chunks:
+                output.write(chunk)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from products.counters import flush_popularity
+
+
+class Command(BaseCommand):
+    help = "Fold buffered popularity increments into Product.popularity"
+
+    def handle(self, *args, **options):
+        updated = flush_popularity()
+        self.stdout.write(f"Updated popularity for {updated} products")
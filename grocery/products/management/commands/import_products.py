@@ -0,0 +1,30 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from products.transfer import FORMATS, import_products
+
+
+class Command(BaseCommand):
+    help = "Upsert products by sku from a CSV or JSONL file (- for stdin)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=FORMATS, default=None)
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+
+        if path == "-":
+            result = import_products(sys.stdin, fmt, options["chunk_size"])
+        else:
+            try:
+                stream = open(path, newline="", encoding="utf-8")
+            except OSError as e:
+                raise CommandError(str(e))
+            with stream:
+                result = import_products(stream, fmt, options["chunk_size"])
+
+        for error in result["errors"]:
+            self.stderr.write(f"row {error['row']}: {error['error']}")
+        self.stdout.write(f"Imported {result['imported']} products")
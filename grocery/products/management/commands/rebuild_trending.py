@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from products.trending import rebuild_trending
+
+
+class Command(BaseCommand):
+    help = "Recompute product trending scores from order history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="Only count sales from the last N days (default: 20 half-lives)")
+        parser.add_argument("--include-archive", action="store_true", help="Also read archived orders")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        total = rebuild_trending(
+            days=options["days"],
+            include_archive=options["include_archive"],
+            chunk_size=options["chunk_size"]
+        )
+        self.stdout.write(f"Rebuilt trending scores for {total} products")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.locks import LockTimeout
+from products.recommendations import update_recommendations
+
+
+class Command(BaseCommand):
+    help = "Count products bought together in orders since the last run and refresh recommendations"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Start over from every order, archive included")
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Orders read per transaction")
+
+    def handle(self, *args, **options):
+        try:
+            orders, products = update_recommendations(full=options["full"], chunk_size=options["chunk_size"])
+        except LockTimeout:
+            raise CommandError("Another recommendations run is still going")
+        self.stdout.write(f"Read {orders} orders, refreshed recommendations for {products} products")
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:05
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copy of products.search as of this migration; migrations must not
+# depend on code that keeps changing
+WORD_RE = re.compile(r"\w+")
+MAX_TERM_LENGTH = 64
+NAME_WEIGHT = 3
+CATEGORY_WEIGHT = 1
+BATCH_SIZE = 1000
+
+
+def tokenize(text):
+    return [word[:MAX_TERM_LENGTH] for word in WORD_RE.findall((text or "").lower())]
+
+
+def product_terms(name, category):
+    terms = {}
+    for word in tokenize(category):
+        terms[word] = terms.get(word, 0) + CATEGORY_WEIGHT
+    for word in tokenize(name):
+        terms[word] = terms.get(word, 0) + NAME_WEIGHT
+    return terms
+
+
+def index_existing_products(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductSearchTerm = apps.get_model('products', 'ProductSearchTerm')
+
+    batch = []
+    for product_id, name, category in Product.objects.values_list('id', 'name', 'category').iterator(chunk_size=BATCH_SIZE):
+        batch.extend(
+            ProductSearchTerm(term=term, product_id=product_id, weight=weight)
+            for term, weight in product_terms(name, category).items()
+        )
+        if len(batch) >= BATCH_SIZE:
+            ProductSearchTerm.objects.bulk_create(batch)
+            batch = []
+
+    if batch:
+        ProductSearchTerm.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_popularitydelta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=64)),
+                ('weight', models.IntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='products.product')),
+            ],
+        ),
+        migrations.RunPython(index_existing_products, migrations.RunPython.noop),
+    ]
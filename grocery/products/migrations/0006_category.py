@@ -0,0 +1,60 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def categories_from_strings(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    Product = apps.get_model('products', 'Product')
+
+    # Free-text values that differ only in case/whitespace become one category
+    categories = {}
+    for value in Product.objects.values_list('category_name', flat=True).distinct():
+        name = (value or '').strip() or 'Uncategorized'
+        if name.lower() not in categories:
+            categories[name.lower()] = Category.objects.create(name=name)
+
+    for value in Product.objects.values_list('category_name', flat=True).distinct():
+        category = categories[((value or '').strip() or 'Uncategorized').lower()]
+        Product.objects.filter(category_name=value).update(category=category)
+
+    for category in categories.values():
+        category.product_count = Product.objects.filter(category=category).count()
+        category.save(update_fields=['product_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_productsearchterm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('product_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RenameField(
+            model_name='product',
+            old_name='category',
+            new_name='category_name',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='category',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='products', to='products.category'),
+        ),
+        migrations.RunPython(categories_from_strings, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='product',
+            name='category_name',
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='products', to='products.category'),
+        ),
+    ]
@@ -1,12 +1,83 @@
 from django.db import models
 
+
+class Category(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    # number of products in this category, kept up to date by product
+    # writes (see products.categories) so facet counts never need a GROUP BY
+    product_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+
 class Product(models.Model):
+    # supplier stock-keeping unit; the key catalog imports upsert on
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=255)
-    category = models.CharField(max_length=100)
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, related_name='products')
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField()
     image_url = models.URLField(blank=True, null=True)
     popularity = models.IntegerField(default=0)  # times purchased
+    # time-decayed sales, stored forward-decayed (see products.trending)
+    trending = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            # popular=true listing / cursor
+            models.Index(fields=['popularity', 'id'], name='product_popularity_idx'),
+            # sort=trending listing / cursor, top-N trending
+            models.Index(fields=['trending', 'id'], name='product_trending_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+
+# Append-only popularity increments written at checkout. Inserting a row
+# never contends with other checkouts, unlike updating the Product row;
+# flush_popularity folds them into Product.popularity periodically.
+class PopularityDelta(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+
+
+# Inverted index for product search: one row per (word, product). Search
+# looks terms up by prefix on the term index, so its cost follows the
+# number of matching products rather than the size of the catalog.
+# Maintained by products.search.index_products.
+class ProductSearchTerm(models.Model):
+    term = models.CharField(max_length=64, db_index=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_terms')
+    weight = models.IntegerField()
+
+
+# "Frequently bought together" data, built offline by
+# products.recommendations.update_recommendations from order history.
+# ProductPair counts the orders containing both products (stored in both
+# directions); ProductRecommendation keeps each product's top pairs ranked,
+# so a product page reads them with one index lookup.
+class ProductPair(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    orders = models.IntegerField()
+
+    class Meta:
+        unique_together = ('product', 'other')
+
+
+class ProductRecommendation(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    orders = models.IntegerField()
+    rank = models.IntegerField()
+
+    class Meta:
+        unique_together = ('product', 'rank')
+
+
+# Highest order id already counted into ProductPair (a single row)
+class RecommendationCheckpoint(models.Model):
+    last_order_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,121 @@
+from collections import Counter, defaultdict
+from heapq import nsmallest
+from itertools import groupby, permutations
+from operator import itemgetter
+from django.db import transaction
+from . cache import invalidate_product_cache
+from . models import ProductPair, ProductRecommendation, RecommendationCheckpoint
+
+# Recommendations kept per product
+TOP_K = 10
+# Orders with more distinct products than this are skipped: they add
+# n^2 pairs and say little about what goes together
+MAX_ORDER_PRODUCTS = 50
+WRITE_CHUNK_SIZE = 500
+
+
+# Count product pairs in orders placed since the last run into ProductPair
+# and re-rank the products whose pairs changed. Orders are read chunk_size
+# at a time; each chunk is written together with the checkpoint, so an
+# interrupted run resumes where it stopped. full=True starts over from
+# every order, archive included. Returns (orders read, products re-ranked);
+# LockTimeout if another run is still going.
+def update_recommendations(full=False, chunk_size=10000):
+    from orders.archive import advance_checkpoint, job_lock, order_chunks, settled_order_id
+
+    with job_lock("recommendations"):
+        RecommendationCheckpoint.objects.get_or_create(id=1)
+        with transaction.atomic():
+            checkpoint = RecommendationCheckpoint.objects.select_for_update().get(id=1)
+            if full:
+                ProductPair.objects.all().delete()
+                ProductRecommendation.objects.all().delete()
+                checkpoint.last_order_id = 0
+                checkpoint.save()
+
+        orders_read = 0
+        reranked = set()
+        overtaken = False
+
+        # Archived orders are only read on a full rebuild
+        chunks = order_chunks(checkpoint.last_order_id, settled_order_id(), include_archive=full, chunk_size=chunk_size)
+        for item_model, after, last_id, count, live in chunks:
+            if live and overtaken:
+                continue
+            pairs = count_pairs(item_model, after, last_id)
+            with transaction.atomic():
+                # As in update_sales_rollups: live orders past a checkpoint
+                # another run has moved are that run's
+                if live and not advance_checkpoint(RecommendationCheckpoint, after, last_id):
+                    overtaken = True
+                    continue
+                reranked.update(apply_pairs(pairs))
+            orders_read += count
+
+    # Recommendation responses are cached with product pages
+    if reranked:
+        invalidate_product_cache(all_products=True)
+
+    return orders_read, len(reranked)
+
+
+# (product_id, other_id) -> number of orders in (after, upto] with both,
+# counted in both directions
+def count_pairs(item_model, after, upto):
+    lines = (
+        item_model.objects.filter(order_id__gt=after, order_id__lte=upto)
+        .order_by("order_id").values_list("order_id", "product_id")
+    )
+
+    pairs = Counter()
+    for order_id, order_lines in groupby(lines.iterator(chunk_size=5000), key=itemgetter(0)):
+        products = {product_id for _, product_id in order_lines}
+        if 1 < len(products) <= MAX_ORDER_PRODUCTS:
+            pairs.update(permutations(products, 2))
+    return pairs
+
+
+# Add pair counts to ProductPair and rebuild the top-K recommendations of
+# every product involved. Returns the product ids re-ranked.
+def apply_pairs(pairs):
+    added = defaultdict(dict)
+    for (product_id, other_id), orders in pairs.items():
+        added[product_id][other_id] = orders
+
+    product_ids = sorted(added)
+    for start in range(0, len(product_ids), WRITE_CHUNK_SIZE):
+        chunk = product_ids[start:start + WRITE_CHUNK_SIZE]
+
+        # Every pair of these products: needed anyway to rank them
+        counts = defaultdict(dict)
+        row_ids = {}
+        existing = ProductPair.objects.filter(product_id__in=chunk).values_list("id", "product_id", "other_id", "orders")
+        for row_id, product_id, other_id, orders in existing:
+            counts[product_id][other_id] = orders
+            row_ids[product_id, other_id] = row_id
+
+        new_pairs = []
+        changed_pairs = []
+        for product_id in chunk:
+            for other_id, orders in added[product_id].items():
+                total = counts[product_id].get(other_id, 0) + orders
+                counts[product_id][other_id] = total
+                if (product_id, other_id) in row_ids:
+                    changed_pairs.append(ProductPair(id=row_ids[product_id, other_id], orders=total))
+                else:
+                    new_pairs.append(ProductPair(product_id=product_id, other_id=other_id, orders=total))
+
+        ProductPair.objects.bulk_create(new_pairs, batch_size=WRITE_CHUNK_SIZE)
+        ProductPair.objects.bulk_update(changed_pairs, ["orders"], batch_size=WRITE_CHUNK_SIZE)
+
+        # Most orders together first, lower id on ties
+        ProductRecommendation.objects.filter(product_id__in=chunk).delete()
+        ProductRecommendation.objects.bulk_create([
+            ProductRecommendation(product_id=product_id, recommended_id=other_id, orders=orders, rank=rank)
+            for product_id in chunk
+            for rank, (other_id, orders) in enumerate(
+                nsmallest(TOP_K, counts[product_id].items(), key=lambda pair: (-pair[1], pair[0])), start=1
+            )
+        ], batch_size=WRITE_CHUNK_SIZE)
+
+    return product_ids
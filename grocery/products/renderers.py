@@ -0,0 +1,94 @@
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+# Row renderers turn values_list() tuples straight into response dicts,
+# skipping model instances and serializer field lookup. Each renderer is
+# compiled once into a function whose body is a single dict literal, so
+# rendering a row costs a few index lookups and the conversions it needs.
+
+
+class RowRenderer:
+
+    # fields: (key, column) or (key, column or tuple of columns, convert).
+    # convert gets the column values in order; without it the value is
+    # used as is. constants are appended to every row after the fields.
+    def __init__(self, *fields, constants=None):
+        self.columns = []
+        self.keys = []
+        namespace = {}
+        parts = []
+
+        for i, field in enumerate(fields):
+            key, columns, convert = field if len(field) == 3 else (*field, None)
+            if isinstance(columns, str):
+                columns = (columns,)
+            args = ", ".join(f"row[{self.index(column)}]" for column in columns)
+            self.keys.append(key)
+
+            if convert is None:
+                parts.append(f"{key!r}: {args}")
+            else:
+                namespace[f"convert_{i}"] = convert
+                parts.append(f"{key!r}: convert_{i}({args})")
+
+        for i, (key, value) in enumerate((constants or {}).items()):
+            namespace[f"constant_{i}"] = value
+            self.keys.append(key)
+            parts.append(f"{key!r}: constant_{i}")
+
+        self.render_row = eval(f"lambda row: {{{', '.join(parts)}}}", namespace)
+
+    def index(self, column):
+        if column not in self.columns:
+            self.columns.append(column)
+        return self.columns.index(column)
+
+    # Columns to select: the renderer's own, then any extra ones the caller
+    # needs (cursor keys etc.); rendering ignores the extras
+    def columns_with(self, *extra):
+        return self.columns + [column for column in dict.fromkeys(extra) if column not in self.columns]
+
+    def __call__(self, rows):
+        return list(map(self.render_row, rows))
+
+
+# Decimal -> "1.50", exactly as DRF's DecimalField renders it
+def decimal_string(decimal_places):
+    exponent = Decimal(1).scaleb(-decimal_places)
+
+    def convert(value):
+        if value is None:
+            return None
+        return format(value.quantize(exponent, rounding=ROUND_HALF_UP), "f")
+
+    return convert
+
+
+def to_float(value):
+    return None if value is None else float(value)
+
+
+# float(price * quantity), multiplied as Decimal so totals don't pick up
+# float rounding
+def line_total(price, quantity):
+    return float(price * quantity)
+
+
+# Same keys, order and formatting as ProductSerializer
+PRODUCT_FIELDS = {
+    "id": ("id", "id"),
+    "category": ("category", "category__name"),
+    "sku": ("sku", "sku"),
+    "name": ("name", "name"),
+    "price": ("price", "price", decimal_string(2)),
+    "stock": ("stock", "stock"),
+    "image_url": ("image_url", "image_url"),
+    "popularity": ("popularity", "popularity"),
+}
+
+
+# Renderer for products with only `fields` (a tuple of PRODUCT_FIELDS
+# keys, in output order), or every field
+@lru_cache(maxsize=128)
+def product_renderer(fields=None):
+    return RowRenderer(*[PRODUCT_FIELDS[field] for field in (fields or PRODUCT_FIELDS)])
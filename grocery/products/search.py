@@ -0,0 +1,83 @@
+import re
+from django.db.models import Case, Count, Q, Sum, When
+from . models import Product, ProductSearchTerm
+
+WORD_RE = re.compile(r"\w+")
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 5
+
+# A name match counts for more than a category match
+NAME_WEIGHT = 3
+CATEGORY_WEIGHT = 1
+
+
+def tokenize(text):
+    return [word[:MAX_TERM_LENGTH] for word in WORD_RE.findall((text or "").lower())]
+
+
+# term -> weight for one product
+def product_terms(name, category):
+    terms = {}
+    for word in tokenize(category):
+        terms[word] = terms.get(word, 0) + CATEGORY_WEIGHT
+    for word in tokenize(name):
+        terms[word] = terms.get(word, 0) + NAME_WEIGHT
+    return terms
+
+
+# (Re)build the index rows for the given products: one delete, one insert
+def index_products(products):
+    products = list(products)
+    ProductSearchTerm.objects.filter(product__in=products).delete()
+    ProductSearchTerm.objects.bulk_create([
+        ProductSearchTerm(term=term, product_id=product.id, weight=weight)
+        for product in products
+        for term, weight in product_terms(product.name, product.category.name).items()
+    ])
+
+
+# Product ids matching every word of `query` (as a prefix), best first.
+# Returns at most `limit` ids starting at `offset`.
+def search_product_ids(query, limit, offset=0):
+    words = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not words:
+        return []
+
+    # Prefix LIKEs, each a range scan on the term index
+    prefixes = Q()
+    for word in words:
+        prefixes |= Q(term__startswith=word)
+    matches = ProductSearchTerm.objects.filter(prefixes)
+
+    # One hit counter per query word so only products matching all of them survive
+    hits = {
+        f"hits_{i}": Count(Case(When(term__startswith=word, then=1)))
+        for i, word in enumerate(words)
+    }
+
+    rows = (
+        matches.values("product_id")
+        .annotate(score=Sum("weight"), **hits)
+        .filter(**{f"{name}__gt": 0 for name in hits})
+        .order_by("-score", "product_id")
+        .values_list("product_id", flat=True)
+    )
+    return list(rows[offset:offset + limit])
+
+
+def rebuild_search_index(batch_size=1000):
+    ProductSearchTerm.objects.all().delete()
+    products = Product.objects.select_related("category").only("id", "name", "category__name").order_by("id")
+
+    batch = []
+    total = 0
+    for product in products.iterator(chunk_size=batch_size):
+        batch.append(product)
+        if len(batch) == batch_size:
+            index_products(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        index_products(batch)
+        total += len(batch)
+    return total
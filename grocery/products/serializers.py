@@ -1,7 +1,39 @@
 from rest_framework import serializers
-from . models import Product
+from . models import Category, Product
+from . categories import get_or_create_category
+
+
+# Products read and write their category by name ("fruit"), as they did
+# when it was a plain text field. Validation only checks the name; the
+# category is looked up (or created) when the product is saved, so a
+# request that fails validation never leaves a new category behind.
+class CategoryNameField(serializers.RelatedField):
+
+    def to_representation(self, value):
+        return value.name
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str) or not data.strip():
+            raise serializers.ValidationError("Category name is required")
+        if len(data.strip()) > 100:
+            raise serializers.ValidationError("Category name is too long")
+        return data.strip()
+
 
 class ProductSerializer(serializers.ModelSerializer):
+    category = CategoryNameField(queryset=Category.objects.all())
+
     class Meta:
         model = Product
-        fields = '__all__'
+        # the raw trending column only means something relative to other rows
+        exclude = ['trending']
+
+    # Called from serializer.save(), inside the views' transaction
+    def create(self, validated_data):
+        validated_data["category"] = get_or_create_category(validated_data["category"])
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        if "category" in validated_data:
+            validated_data["category"] = get_or_create_category(validated_data["category"])
+        return super().update(instance, validated_data)
@@ -1,3 +1,452 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from orders.archive import job_lock, order_chunks
+from orders.models import Order, OrderItem
+from users.models import User
+from . cache import fill
+from . counters import flush_popularity, record_popularity
+from . locks import LockTimeout, acquire_lock, cache_lock, lock_path, release_lock
+from . models import Category, PopularityDelta, Product, ProductPair
+from . recommendations import update_recommendations
+from . transfer import export_products, import_products, keyset_rows
 
-# Create your tests here.
+
+# Product GETs come back as cached JSON, so responses are read with json()
+class ProductListTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        fruit = Category.objects.create(name="fruit")
+        veg = Category.objects.create(name="veg")
+
+        # Popularity and trending repeat so the cursors have ties to break
+        self.products = Product.objects.bulk_create([
+            Product(
+                name=f"product {i}", category=fruit if i % 2 else veg, price=f"{i}.50", stock=i,
+                popularity=i % 3, trending=float(i % 4) / 3
+            )
+            for i in range(11)
+        ])
+
+    def walk(self, limit, params=""):
+        ids = []
+        response = self.client.get(f"/products/?limit={limit}{params}")
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()["results"]), limit)
+            ids += [product["id"] for product in response.json()["results"]]
+            if response.json()["next"] is None:
+                return ids
+            response = self.client.get(f"/products/?limit={limit}{params}&cursor={response.json()['next']}")
+
+    def test_cursor_by_id(self):
+        expected = [product.id for product in self.products]
+        for limit in (1, 3, 11, 50):
+            self.assertEqual(self.walk(limit), expected)
+
+    def test_cursor_by_popularity(self):
+        expected = [p.id for p in sorted(self.products, key=lambda p: (p.popularity, p.id), reverse=True)]
+        for limit in (1, 4, 50):
+            self.assertEqual(self.walk(limit, "&sort=popular"), expected)
+        self.assertEqual(self.walk(4, "&popular=true"), expected)
+
+    def test_cursor_by_trending(self):
+        expected = [p.id for p in sorted(self.products, key=lambda p: (p.trending, p.id), reverse=True)]
+        for limit in (1, 4, 50):
+            self.assertEqual(self.walk(limit, "&sort=trending"), expected)
+
+    def test_cursor_within_category(self):
+        expected = [p.id for p in self.products if p.category.name == "veg"]
+        self.assertEqual(self.walk(2, "&category=veg"), expected)
+
+    def test_sparse_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/products/?limit=2&fields=name,price")
+
+        self.assertEqual(response.json()["results"], [
+            {"name": "product 0", "price": "0.50"},
+            {"name": "product 1", "price": "1.50"},
+        ])
+        # Only the requested columns (and the cursor's id) are selected
+        select = queries[0]["sql"]
+        self.assertNotIn("stock", select)
+        self.assertNotIn("category", select)
+
+    def test_full_rows(self):
+        response = self.client.get("/products/?limit=1")
+
+        self.assertEqual(response.json()["results"], [{
+            "id": self.products[0].id,
+            "category": "veg",
+            "sku": None,
+            "name": "product 0",
+            "price": "0.50",
+            "stock": 0,
+            "image_url": None,
+            "popularity": 0,
+        }])
+
+    def test_bad_parameters(self):
+        for params in ("cursor=abc", "sort=popular&cursor=MQ==", "sort=cheap", "fields=name,colour", "limit=0"):
+            response = self.client.get(f"/products/?{params}")
+            self.assertEqual(response.status_code, 400, params)
+
+
+class FlushPopularityTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name="fruit")
+        self.apple, self.pear, self.plum = Product.objects.bulk_create([
+            Product(name=name, category=category, price="1.00", stock=10, popularity=5)
+            for name in ("apple", "pear", "plum")
+        ])
+
+    def test_deltas_are_folded_and_removed(self):
+        record_popularity({self.apple.id: 2, self.pear.id: 1})
+        record_popularity({self.apple.id: 3})
+
+        self.assertEqual(flush_popularity(batch_size=2), 2)
+
+        popularity = dict(Product.objects.values_list("name", "popularity"))
+        self.assertEqual(popularity, {"apple": 10, "pear": 6, "plum": 5})
+        self.assertFalse(PopularityDelta.objects.exists())
+        self.assertEqual(flush_popularity(), 0)
+
+
+@override_settings(STOCK_RESERVATIONS=False, CART_STORE="database")
+class BulkUpdateTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="manager", password="x", role="manager"))
+        category = Category.objects.create(name="fruit")
+        self.apple, self.pear, self.plum = Product.objects.bulk_create([
+            Product(name=name, category=category, price="2.00", stock=10)
+            for name in ("apple", "pear", "plum")
+        ])
+
+    def update(self, updates):
+        return self.client.post("/products/bulk-update/", {"updates": updates}, format="json")
+
+    def test_valid_rows_apply_and_bad_rows_are_reported(self):
+        response = self.update({
+            str(self.apple.id): {"price": "1.99", "stock": 40},
+            str(self.pear.id): {"stock_delta": -4},
+            str(self.plum.id): {"stock_delta": -11},
+            "999": {"stock": 1},
+            "x": {"stock": 1},
+            str(self.plum.id + 100): {"stock": 1, "stock_delta": 1},
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["updated"], 2)
+        self.assertEqual(
+            sorted(str(row["id"]) for row in response.data["failed"]),
+            sorted(["x", str(self.plum.id + 100), "999", str(self.plum.id)])
+        )
+        self.assertEqual(
+            dict(Product.objects.values_list("name", "stock")),
+            {"apple": 40, "pear": 6, "plum": 10}
+        )
+        self.assertEqual(str(Product.objects.get(id=self.apple.id).price), "1.99")
+
+    def test_repricing_reaches_carts_and_cached_pages(self):
+        customer = APIClient()
+        customer.force_authenticate(User.objects.create_user(username="customer", password="x"))
+        customer.post("/cart/add/", {"product_id": self.apple.id, "quantity": 2}, format="json")
+        etag = customer.get("/cart/summary/")["ETag"]
+        self.assertEqual(self.client.get(f"/products/{self.apple.id}/").json()["price"], "2.00")
+
+        self.update({str(self.apple.id): {"price": "3.00"}})
+
+        summary = customer.get("/cart/summary/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(summary.status_code, 200)
+        self.assertEqual(summary.data["subtotal"], 6.0)
+        self.assertEqual(self.client.get(f"/products/{self.apple.id}/").json()["price"], "3.00")
+
+    def test_managers_only(self):
+        customer = APIClient()
+        customer.force_authenticate(User.objects.create_user(username="customer", password="x"))
+
+        response = customer.post("/products/bulk-update/", {"updates": {str(self.apple.id): {"stock": 1}}}, format="json")
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Product.objects.get(id=self.apple.id).stock, 10)
+        self.assertEqual(self.update({}).status_code, 400)
+
+
+@override_settings(STOCK_RESERVATIONS=False, CART_STORE="database")
+class CatalogTransferTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="manager", password="x", role="manager"))
+        fruit = Category.objects.create(name="fruit")
+        Product.objects.create(sku="A1", name="apple", category=fruit, price="2.00", stock=10)
+
+    def products(self):
+        return {
+            product.sku: (product.name, product.category.name, str(product.price), product.stock)
+            for product in Product.objects.select_related("category")
+        }
+
+    def test_csv_rows_are_upserted_by_sku(self):
+        stream = io.StringIO(
+            "sku,name,category,price,stock,image_url\n"
+            "A1,green apple,Fruit,2.50,7,\n"
+            "P1,pear,fruit,3,4,\n"
+            "C1,carrot,veg,-1,4,\n"
+        )
+
+        result = import_products(stream, "csv")
+
+        self.assertEqual(result["imported"], 2)
+        self.assertEqual(result["errors"], [{"row": 3, "error": "price and stock can't be negative"}])
+        self.assertEqual(self.products(), {
+            "A1": ("green apple", "fruit", "2.50", 7),
+            "P1": ("pear", "fruit", "3.00", 4),
+        })
+        self.assertEqual(Category.objects.get(name="fruit").product_count, 2)
+
+    def test_bad_jsonl_line_is_reported_and_the_rest_imported(self):
+        stream = io.StringIO(
+            '{"sku": "P1", "name": "pear", "category": "fruit", "price": "3", "stock": 4}\n'
+            '{"sku": "P2", "name": "plum", "category": "fruit", "price": "1", "stock": 2}\n'
+            '{"sku": "C1", "name": "carrot", "category": "veg", "price": "1",\n'
+            '\n'
+            '["not", "an", "object"]\n'
+            '{"sku": "C2", "name": "leek", "category": "veg", "price": "2", "stock": 3}\n'
+        )
+
+        # Earlier chunks are committed before the bad line is reached
+        result = import_products(stream, "jsonl", chunk_size=2)
+
+        self.assertEqual(result["imported"], 3)
+        self.assertEqual(result["errors"], [
+            {"row": 3, "error": "Invalid JSON"},
+            {"row": 4, "error": "Row must be an object"},
+        ])
+        self.assertEqual(set(self.products()), {"A1", "P1", "P2", "C2"})
+        self.assertEqual(
+            dict(Category.objects.values_list("name", "product_count")),
+            {"fruit": 3, "veg": 1}
+        )
+
+    def test_counters_are_fixed_up_when_the_file_breaks_off(self):
+        # Decoding goes a buffer at a time, so the bad byte comes well after
+        # the first rows
+        rows = "".join(f"P{i},pear {i},fruit,3,4\n" for i in range(1000))
+        stream = io.TextIOWrapper(
+            io.BytesIO(f"sku,name,category,price,stock\n{rows}".encode() + b"X1,\xff,fruit,1,1\n"),
+            encoding="utf-8", newline=""
+        )
+        self.assertEqual(len(self.client.get("/products/?category=fruit&limit=2").json()["results"]), 1)
+
+        with self.assertRaises(UnicodeDecodeError):
+            import_products(stream, "csv", chunk_size=100)
+
+        imported = Product.objects.count()
+        self.assertGreater(imported, 1)
+        self.assertEqual(Category.objects.get(name="fruit").product_count, imported)
+        self.assertEqual(len(self.client.get("/products/?category=fruit&limit=2").json()["results"]), 2)
+
+    def test_import_endpoint(self):
+        upload = SimpleUploadedFile("catalog.jsonl", b'{"sku": "P1", "name": "pear", "category": "fruit", "price": "3", "stock": 4}\n')
+
+        response = self.client.post("/products/import/", {"file": upload}, format="multipart")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"imported": 1, "errors": []})
+
+        response = self.client.generic(
+            "POST", "/products/import/", b"sku,name,category,price,stock\nP2,plum,fruit,1,2\n", content_type="text/csv"
+        )
+
+        self.assertEqual(response.data, {"imported": 1, "errors": []})
+        self.assertEqual(set(self.products()), {"A1", "P1", "P2"})
+
+        response = self.client.generic("POST", "/products/import/", b"\xff\xfe", content_type="text/csv")
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_streams_every_product(self):
+        Product.objects.create(sku="P1", name="pear", category=Category.objects.get(name="fruit"), price="3.00", stock=4)
+        apple, pear = Product.objects.order_by("id")
+
+        response = self.client.get("/products/export/")
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(b"".join(response.streaming_content).decode().splitlines(), [
+            "id,sku,name,category,price,stock,image_url,popularity",
+            f"{apple.id},A1,apple,fruit,2.00,10,,0",
+            f"{pear.id},P1,pear,fruit,3.00,4,,0",
+        ])
+
+        response = self.client.get("/products/export/?file_format=jsonl")
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('"sku": "P1"', lines[1])
+        self.assertIn('"price": "3.00"', lines[1])
+
+    def test_export_reads_keyset_chunks(self):
+        fruit = Category.objects.get(name="fruit")
+        Product.objects.bulk_create([
+            Product(sku=f"P{i}", name=f"pear {i}", category=fruit, price="1.00", stock=1) for i in range(4)
+        ])
+
+        with CaptureQueriesContext(connection) as queries:
+            lines = "".join(export_products("csv", chunk_size=2)).splitlines()
+
+        self.assertEqual([line.split(",")[1] for line in lines[1:]], ["A1", "P0", "P1", "P2", "P3"])
+        # Chunks of 2, 2 and 1, each query starting after the last id read
+        self.assertEqual(len(queries), 3)
+        self.assertIn(">", queries[1]["sql"])
+
+    def test_keyset_rows_follow_a_mixed_key(self):
+        fruit = Category.objects.get(name="fruit")
+        Product.objects.bulk_create([
+            Product(name=f"pear {i}", category=fruit, price="1.00", stock=1, popularity=i % 3) for i in range(7)
+        ])
+        expected = list(Product.objects.order_by("-popularity", "id").values_list("popularity", "id"))
+
+        for chunk_size, limit in ((1, None), (2, None), (3, 5), (50, 4)):
+            rows = keyset_rows(Product.objects.all(), ["popularity", "id"], ("-popularity", "id"), chunk_size, limit)
+            self.assertEqual(list(rows), expected[:limit], (chunk_size, limit))
+
+    def test_managers_only(self):
+        customer = APIClient()
+        customer.force_authenticate(User.objects.create_user(username="customer", password="x"))
+
+        self.assertEqual(customer.get("/products/export/").status_code, 403)
+        self.assertEqual(customer.generic("POST", "/products/import/", b"", content_type="text/csv").status_code, 403)
+
+
+class RecommendationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="alice", password="x")
+        category = Category.objects.create(name="fruit")
+        self.apple, self.pear, self.plum = Product.objects.bulk_create([
+            Product(name=name, category=category, price="1.00", stock=10)
+            for name in ("apple", "pear", "plum")
+        ])
+        for products in ((self.apple, self.pear), (self.apple, self.pear), (self.apple, self.plum)):
+            self.place_order(products)
+
+    def place_order(self, products):
+        order = Order.objects.create(user=self.user, total_price=len(products))
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=p, price=1, quantity=1) for p in products])
+        # Old enough for update_recommendations to read
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=1))
+
+    def recommended(self, product):
+        response = self.client.get(f"/products/{product.id}/recommendations/")
+        return [(item["name"], item["orders_together"]) for item in response.json()["results"]]
+
+    def test_pairs_are_counted_once(self):
+        self.assertEqual(update_recommendations(chunk_size=2), (3, 3))
+        self.assertEqual(update_recommendations(), (0, 0))
+
+        self.assertEqual(self.recommended(self.apple), [("pear", 2), ("plum", 1)])
+        self.assertEqual(self.recommended(self.plum), [("apple", 1)])
+
+    def test_run_that_was_overtaken_stops(self):
+        update_recommendations()
+
+        # A run that read the checkpoint before the first one moved it
+        stale_chunks = lambda after, *args, **kwargs: order_chunks(0, *args, **kwargs)
+        with mock.patch("orders.archive.order_chunks", stale_chunks):
+            self.assertEqual(update_recommendations(chunk_size=1), (0, 0))
+
+        self.assertEqual(ProductPair.objects.get(product=self.apple, other=self.pear).orders, 2)
+
+    def test_one_run_at_a_time(self):
+        with job_lock("recommendations"):
+            with self.assertRaises(LockTimeout):
+                update_recommendations()
+
+        self.assertFalse(ProductPair.objects.exists())
+
+
+class LockTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_cache = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory.name}
+        self.enterContext(override_settings(CACHES={"default": file_cache}))
+
+    def test_file_lock_is_exclusive(self):
+        token = acquire_lock("page", timeout=10)
+
+        self.assertIsNotNone(token)
+        self.assertIsNone(acquire_lock("page", timeout=10))
+        self.assertIsNotNone(acquire_lock("other page", timeout=10))
+
+        release_lock("page", token)
+        self.assertIsNotNone(acquire_lock("page", timeout=10))
+
+    def test_stale_file_lock_is_taken_over(self):
+        token = acquire_lock("page", timeout=10)
+        path = lock_path(caches["default"], "page")
+        os.utime(path, (time.time() - 60, time.time() - 60))
+
+        self.assertIsNotNone(acquire_lock("page", timeout=10))
+        # The old holder's release leaves the new lock alone
+        release_lock("page", token)
+        self.assertIsNone(acquire_lock("page", timeout=10))
+
+    def test_cache_lock_times_out(self):
+        acquire_lock("page", timeout=10)
+
+        with self.assertRaises(LockTimeout):
+            with cache_lock("page", timeout=10, wait=0.1):
+                pass
+
+    def test_concurrent_miss_waits_for_the_first_fill(self):
+        entry = ('"etag"', b"{}")
+        token = acquire_lock("products:page:x", timeout=10)
+        filler = threading.Timer(0.2, lambda: caches["default"].set("products:page:x", entry))
+        filler.start()
+        self.addCleanup(filler.cancel)
+
+        result = fill("products:page:x", lambda: self.fail("computed twice"))
+
+        self.assertEqual(result, entry)
+        release_lock("products:page:x", token)
+
+
+class ProductCacheKeyTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        category = Category.objects.create(name="fruit")
+        Product.objects.create(name="apple", category=category, price="1.00", stock=1)
+
+    def test_unread_parameters_share_one_entry(self):
+        self.client.get("/products/?limit=5")
+        entries = len(cache._cache)
+
+        self.client.get("/products/?limit=5&junk=1")
+        self.client.get("/products/?junk=2&limit=5")
+
+        self.assertEqual(len(cache._cache), entries)
+        self.client.get("/products/?limit=6")
+        self.assertGreater(len(cache._cache), entries)
@@ -0,0 +1,219 @@
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Q
+from cart.stores import cart_products_changed
+from . cache import invalidate_product_cache
+from . categories import recount_categories
+from . models import Category, Product
+from . search import index_products
+
+# Bulk catalog import/export. Imports upsert by sku one chunk per
+# transaction; exports read rows in keyset chunks so memory stays flat.
+# FORMATS, keyset_rows() and stream_records() are shared with the report
+# exports.
+IMPORT_FIELDS = ["sku", "name", "category", "price", "stock", "image_url"]
+EXPORT_FIELDS = ["id", "sku", "name", "category", "price", "stock", "image_url", "popularity"]
+FORMATS = ("csv", "jsonl")
+MAX_REPORTED_ERRORS = 100
+
+
+# Input rows: dicts for CSV, raw lines for JSONL (parsed by clean_row, so a
+# bad line is reported like any other bad row)
+def read_rows(stream, fmt):
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield line
+
+
+# Product kwargs (category still a name) from one input row, or ValueError
+def clean_row(row):
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except json.JSONDecodeError:
+            raise ValueError("Invalid JSON")
+    if not isinstance(row, dict):
+        raise ValueError("Row must be an object")
+
+    sku = str(row.get("sku") or "").strip()
+    name = str(row.get("name") or "").strip()
+    category = str(row.get("category") or "").strip()
+    if not sku or not name or not category:
+        raise ValueError("sku, name and category are required")
+    if len(sku) > 64 or len(name) > 255 or len(category) > 100:
+        raise ValueError("sku, name or category is too long")
+
+    try:
+        price = Decimal(str(row.get("price"))).quantize(Decimal("0.01"))
+        stock = int(row.get("stock"))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError("price and stock must be numbers")
+    if price < 0 or stock < 0:
+        raise ValueError("price and stock can't be negative")
+
+    return {
+        "sku": sku,
+        "name": name,
+        "category": category,
+        "price": price,
+        "stock": stock,
+        "image_url": row.get("image_url") or None,
+    }
+
+
+# Upsert products from a text stream of CSV or JSONL rows. Returns
+# {"imported": n, "errors": [{"row": line, "error": msg}, ...]}. A stream
+# that can't be read at all (bad encoding, broken CSV quoting) raises, but
+# chunks imported before that stay, with counters and caches fixed up.
+def import_products(stream, fmt, chunk_size=1000):
+    imported = 0
+    errors = []
+    chunk = {}
+
+    try:
+        for number, row in enumerate(read_rows(stream, fmt), start=1):
+            try:
+                cleaned = clean_row(row)
+            except ValueError as e:
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": number, "error": str(e)})
+                continue
+
+            # A later row for the same sku wins
+            chunk[cleaned["sku"]] = cleaned
+            if len(chunk) >= chunk_size:
+                imported += import_chunk(list(chunk.values()))
+                chunk = {}
+
+        if chunk:
+            imported += import_chunk(list(chunk.values()))
+    finally:
+        # Counters and caches are fixed up once for the whole import
+        recount_categories()
+        invalidate_product_cache(all_products=True)
+
+    return {"imported": imported, "errors": errors}
+
+
+def import_chunk(rows):
+    with transaction.atomic():
+        categories = resolve_categories({row["category"] for row in rows})
+
+        products = [
+            Product(**dict(row, category=categories[row["category"].lower()]))
+            for row in rows
+        ]
+
+        # MySQL upserts on any unique key and won't take a conflict target
+        target = {"unique_fields": ["sku"]} if connection.features.supports_update_conflicts_with_target else {}
+        Product.objects.bulk_create(
+            products,
+            update_conflicts=True,
+            update_fields=["name", "category", "price", "stock", "image_url"],
+            **target
+        )
+
+        # Upserts don't hand back ids everywhere; look them up by sku
+        saved = list(
+            Product.objects.filter(sku__in=[row["sku"] for row in rows])
+            .select_related("category")
+            .only("id", "name", "category__name")
+        )
+        index_products(saved)
+        cart_products_changed([product.id for product in saved])
+
+    return len(rows)
+
+
+# lowercased name -> Category for every name, creating missing ones
+def resolve_categories(names):
+    matches = Q()
+    for name in names:
+        matches |= Q(name__iexact=name)
+    found = {c.name.lower(): c for c in Category.objects.filter(matches)}
+
+    missing = [name for name in names if name.lower() not in found]
+    if missing:
+        Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+        found.update({c.name.lower(): c for c in Category.objects.filter(name__in=missing)})
+
+    return found
+
+
+def export_rows(chunk_size):
+    columns = ["id", "sku", "name", "category__name", "price", "stock", "image_url", "popularity"]
+    return keyset_rows(Product.objects.all(), columns, ("id",), chunk_size)
+
+
+# Rows of `queryset` as values_list(*columns) in `key` order, at most
+# `limit` of them, chunk_size per query. Each query starts after the last
+# row of the one before, so rows stream on MySQL too, whose driver buffers
+# a whole result even under iterator(). The key must be unique and its
+# fields among `columns`; "-field" sorts descending.
+def keyset_rows(queryset, columns, key, chunk_size, limit=None):
+    positions = [columns.index(field.lstrip("-")) for field in key]
+    rows = queryset.order_by(*key).values_list(*columns)
+    after = Q()
+
+    while limit is None or limit > 0:
+        size = chunk_size if limit is None else min(chunk_size, limit)
+        chunk = list(rows.filter(after)[:size])
+        yield from chunk
+        if len(chunk) < size:
+            return
+        if limit is not None:
+            limit -= size
+        after = after_key(key, [chunk[-1][i] for i in positions])
+
+
+# Filter for rows after `values` in `key` order
+def after_key(key, values):
+    after = Q()
+    same = Q()
+    for field, value in zip(key, values):
+        column = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        after |= same & Q(**{f"{column}__{lookup}": value})
+        same &= Q(**{column: value})
+    return after
+
+
+# Text chunks of the whole catalog as CSV or JSONL, read from the database
+# chunk_size rows at a time
+def export_products(fmt, chunk_size=2000):
+    records = (dict(zip(EXPORT_FIELDS, row)) for row in export_rows(chunk_size))
+    return stream_records(records, EXPORT_FIELDS, fmt, chunk_size)
+
+
+# Text chunks of `records` (dicts with the `fields` keys) as CSV or JSONL,
+# chunk_size records per chunk. The CSV header goes out before the first
+# record is read, so a slow query doesn't hold up the response.
+def stream_records(records, fields, fmt, chunk_size=2000):
+    buffer = io.StringIO()
+
+    if fmt == "csv":
+        writer = csv.DictWriter(buffer, fields)
+        writer.writeheader()
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        write = writer.writerow
+    else:
+        def write(record):
+            buffer.write(json.dumps(record, cls=DjangoJSONEncoder) + "\n")
+
+    for number, record in enumerate(records, start=1):
+        write(record)
+        if number % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
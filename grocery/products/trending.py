@@ -0,0 +1,78 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from . cache import invalidate_product_cache
+from . models import Product
+
+REBUILD_CHUNK_SIZE = 500
+
+# Trending scores use forward decay: a sale of q units at time t adds
+# q * 2^((t - epoch) / half_life) to Product.trending. Every stored score
+# shares the divisor 2^((now - epoch) / half_life) that turns it into the
+# decayed value, so ordering by the raw column already ranks by decayed
+# score, and placing an order only ever adds to the rows it touches.
+
+
+def trending_weight(at=None):
+    at = at or datetime.now()
+    return 2 ** ((at - settings.TRENDING_EPOCH) / settings.TRENDING_HALF_LIFE)
+
+
+# Decayed score as of `at`: units sold, each counting half as much per
+# half-life of age
+def trending_score(value, at=None):
+    return value / trending_weight(at)
+
+
+# Column expression adding product_id -> quantity sold now, for the UPDATE
+# that already takes the ordered products' stock
+def trending_increment(lines):
+    weight = trending_weight()
+    return Case(
+        *[When(id=product_id, then=F("trending") + Value(quantity * weight)) for product_id, quantity in lines.items()],
+        default=F("trending"),
+        output_field=FloatField()
+    )
+
+
+# Recompute every score from order history. Sales older than `days` are
+# skipped (the default of 20 half-lives leaves them under a millionth of
+# their weight). Orders placed while this runs can be missed; run off-peak.
+def rebuild_trending(days=None, include_archive=False, chunk_size=5000):
+    from orders.archive import order_tables
+
+    since = datetime.now() - (timedelta(days=days) if days is not None else settings.TRENDING_HALF_LIFE * 20)
+    scores = defaultdict(float)
+    weights = {}
+
+    for order_model, item_model in order_tables(include_archive):
+        items = (
+            item_model.objects.filter(order__created_at__gte=since)
+            .values_list("product_id", "quantity", "order__created_at")
+            .order_by()
+        )
+        for product_id, quantity, created_at in items.iterator(chunk_size=chunk_size):
+            # many items share an order timestamp
+            weight = weights.get(created_at)
+            if weight is None:
+                weight = weights[created_at] = trending_weight(created_at)
+            scores[product_id] += quantity * weight
+
+    product_ids = list(scores)
+    with transaction.atomic():
+        Product.objects.exclude(trending=0).update(trending=0)
+        for start in range(0, len(product_ids), REBUILD_CHUNK_SIZE):
+            chunk = product_ids[start:start + REBUILD_CHUNK_SIZE]
+            Product.objects.filter(id__in=chunk).update(
+                trending=Case(
+                    *[When(id=product_id, then=Value(scores[product_id])) for product_id in chunk],
+                    default=F("trending"),
+                    output_field=FloatField()
+                )
+            )
+
+    # only listings sort on the column
+    invalidate_product_cache()
+    return len(product_ids)
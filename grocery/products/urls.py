@@ -3,5 +3,11 @@ from . import views
 
 urlpatterns = [
     path('', views.products_list),
+    path('search/', views.search_products),
+    path('categories/', views.category_facets),
+    path('bulk-update/', views.bulk_update_products),
+    path('import/', views.import_catalog),
+    path('export/', views.export_catalog),
     path('<int:pk>/', views.product_detail),
+    path('<int:pk>/recommendations/', views.product_recommendations),
 ]
@@ -2,30 +2,115 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status
-from . models import Product
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.db.models import Case, DecimalField, F, IntegerField, Q, Value, When
+from . models import Category, Product, ProductRecommendation
+from . cache import cache_product_response, catalog_version, invalidate_product_cache, product_version
+from . categories import adjust_category_counts
 from . serializers import ProductSerializer
+from . renderers import PRODUCT_FIELDS, RowRenderer, decimal_string, product_renderer
 from . permissions import IsManager
+from . search import index_products, search_product_ids
+from . transfer import FORMATS, export_products, import_products
+from cart.stores import cart_products_changed
+from decimal import Decimal, InvalidOperation
+import base64
+import binascii
+import csv
+import io
 
 
 # GET all products / CREATE product (Manager only)
+# GET is cursor-paginated: by id, by (popularity, id) with popular=true or
+# sort=popular, or by (trending, id) with sort=trending, all backed by an
+# index. fields=id,name,price limits the columns the query itself selects,
+# not just the output. Rows are rendered from values_list() tuples.
+PRODUCT_PAGE_SIZE = 50
+MAX_PRODUCT_PAGE_SIZE = 200
+
+# sort= value -> (column, type of its cursor value)
+PRODUCT_SORTS = {
+    "popular": ("popularity", int),
+    "trending": ("trending", float),
+}
+
+
 @api_view(['GET', 'POST'])
+@cache_product_response(catalog_version, params=("category", "sort", "popular", "limit", "fields", "cursor"))
 def products_list(request):
 
     # GET products (public)
     if request.method == 'GET':
         category = request.GET.get("category")
-        popular = request.GET.get("popular")
+        sort = request.GET.get("sort") or ("popular" if request.GET.get("popular") == "true" else None)
+        if sort is not None and sort not in PRODUCT_SORTS:
+            return Response({"error": f"sort must be one of: {', '.join(PRODUCT_SORTS)}"}, status=400)
+        sort_column, sort_type = PRODUCT_SORTS.get(sort, (None, None))
+
+        try:
+            limit = min(int(request.GET.get("limit", PRODUCT_PAGE_SIZE)), MAX_PRODUCT_PAGE_SIZE)
+        except ValueError:
+            return Response({"error": "limit must be a number"}, status=400)
+        if limit < 1:
+            return Response({"error": "limit must be positive"}, status=400)
+
+        fields = request.GET.get("fields")
+        if fields:
+            fields = [field.strip() for field in fields.split(",") if field.strip()]
+            unknown = [field for field in fields if field not in PRODUCT_FIELDS]
+            if unknown or not fields:
+                return Response({"error": f"Unknown fields: {', '.join(unknown)}"}, status=400)
 
         products = Product.objects.all()
 
+        # Exact category name (case-insensitive collation) via the indexed FK
         if category:
-            products = products.filter(category__icontains=category)
+            products = products.filter(category__name=category)
 
-        if popular == "true":
-            products = products.order_by('-popularity')
+        if sort_column:
+            products = products.order_by(f'-{sort_column}', '-id')
+        else:
+            products = products.order_by('id')
 
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        cursor = request.GET.get("cursor")
+        if cursor:
+            try:
+                position = decode_product_cursor(cursor)
+            except ValueError:
+                return Response({"error": "Invalid cursor"}, status=400)
+            if len(position) != (2 if sort_column else 1):
+                return Response({"error": "Invalid cursor"}, status=400)
+
+            try:
+                if sort_column:
+                    value, last_id = sort_type(position[0]), int(position[1])
+                    products = products.filter(
+                        Q(**{f"{sort_column}__lt": value}) | Q(**{sort_column: value, "id__lt": last_id})
+                    )
+                else:
+                    products = products.filter(id__gt=int(position[0]))
+            except ValueError:
+                return Response({"error": "Invalid cursor"}, status=400)
+
+        # Fetch one extra row to know whether there is a next page
+        renderer = product_renderer(tuple(fields) if fields else None)
+        columns = renderer.columns_with("id", sort_column or "id")
+        page = list(products.values_list(*columns)[:limit + 1])
+
+        has_next = len(page) > limit
+        page = page[:limit]
+
+        next_cursor = None
+        if has_next:
+            last = page[-1]
+            last_id = last[columns.index("id")]
+            if sort_column:
+                next_cursor = encode_product_cursor(repr(last[columns.index(sort_column)]), last_id)
+            else:
+                next_cursor = encode_product_cursor(last_id)
+
+        return Response({"next": next_cursor, "results": renderer(page)})
 
     # POST (Managers only)
     if request.method == 'POST':
@@ -34,18 +119,278 @@ def products_list(request):
 
         serializer = ProductSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                product = serializer.save()
+                adjust_category_counts({product.category_id: 1})
+                index_products([product])
+            invalidate_product_cache([product.id])
             return Response(serializer.data, status=201)
 
         return Response(serializer.errors, status=400)
 
 
+# Opaque cursor over the ordering key: "<id>" or "<sort value>|<id>"
+def encode_product_cursor(*values):
+    return base64.urlsafe_b64encode("|".join(str(v) for v in values).encode()).decode()
+
+
+def decode_product_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        return raw.split("|")
+    except (binascii.Error, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+
+# SEARCH products by name / category (public)
+# ?q=words&limit=20&offset=0 -> best matches first; every word must match
+# the start of a word in the product's name or category.
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def search_products(request):
+    query = request.GET.get("q", "")
+
+    try:
+        limit = min(int(request.GET.get("limit", SEARCH_PAGE_SIZE)), MAX_SEARCH_PAGE_SIZE)
+        offset = max(int(request.GET.get("offset", 0)), 0)
+    except ValueError:
+        return Response({"error": "limit and offset must be numbers"}, status=400)
+    if limit < 1:
+        return Response({"error": "limit must be positive"}, status=400)
+
+    # One extra id tells us whether there is a next page
+    ids = search_product_ids(query, limit + 1, offset)
+    has_next = len(ids) > limit
+    ids = ids[:limit]
+
+    renderer = product_renderer()
+    columns = renderer.columns_with("id")
+    rows = {row[columns.index("id")]: row for row in Product.objects.filter(id__in=ids).values_list(*columns)}
+
+    return Response({
+        "next_offset": offset + limit if has_next else None,
+        "results": renderer([rows[i] for i in ids if i in rows])
+    })
+
+
+# CATEGORY FACETS (public): product count per category from the
+# maintained counters, no GROUP BY over the catalog
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def category_facets(request):
+    categories = (
+        Category.objects.filter(product_count__gt=0)
+        .order_by("name")
+        .values("id", "name", "product_count")
+    )
+    return Response(list(categories))
+
+
+# BULK PRICE / STOCK UPDATE (Manager only)
+# Body: {"updates": {"<id>": {"price": "1.99", "stock": 40}, "<id>": {"stock_delta": -5}}}
+# Rows are applied in chunks with one CASE update each, all in one
+# transaction; bad rows are reported and skipped, the rest still apply.
+BULK_UPDATE_CHUNK_SIZE = 500
+MAX_BULK_UPDATES = 50000
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_update_products(request):
+    if request.user.role != "manager":
+        return Response({"error": "Only managers can modify products"}, status=403)
+
+    updates = request.data.get("updates") if isinstance(request.data, dict) else None
+    if not isinstance(updates, dict) or not updates:
+        return Response({"error": "updates must be a non-empty object of id -> changes"}, status=400)
+    if len(updates) > MAX_BULK_UPDATES:
+        return Response({"error": f"At most {MAX_BULK_UPDATES} updates per request"}, status=400)
+
+    failed = []
+    changes = {}  # product_id -> (price or None, stock or None, stock_delta or None)
+
+    for key, change in updates.items():
+        try:
+            product_id = int(key)
+        except (TypeError, ValueError):
+            failed.append({"id": key, "error": "Invalid product id"})
+            continue
+        try:
+            changes[product_id] = parse_stock_price_change(change)
+        except ValueError as e:
+            failed.append({"id": key, "error": str(e)})
+
+    updated = []
+    repriced = []
+    ids = sorted(changes)
+
+    with transaction.atomic():
+        for start in range(0, len(ids), BULK_UPDATE_CHUNK_SIZE):
+            chunk = ids[start:start + BULK_UPDATE_CHUNK_SIZE]
+            current = {
+                product_id: (price, stock)
+                for product_id, price, stock in Product.objects.select_for_update()
+                .filter(id__in=chunk).values_list("id", "price", "stock")
+            }
+
+            price_cases = []
+            stock_cases = []
+            for product_id in chunk:
+                if product_id not in current:
+                    failed.append({"id": product_id, "error": "Product not found"})
+                    continue
+
+                price, stock, stock_delta = changes[product_id]
+                old_price, old_stock = current[product_id]
+                if stock_delta is not None:
+                    stock = old_stock + stock_delta
+                if stock is not None and stock < 0:
+                    failed.append({"id": product_id, "error": "Stock can't go below zero"})
+                    continue
+
+                if price is not None:
+                    price_cases.append(When(id=product_id, then=Value(price)))
+                    if price != old_price:
+                        repriced.append(product_id)
+                if stock is not None:
+                    stock_cases.append(When(id=product_id, then=Value(stock)))
+                updated.append(product_id)
+
+            fields = {}
+            if price_cases:
+                fields["price"] = Case(*price_cases, default=F("price"), output_field=DecimalField(max_digits=10, decimal_places=2))
+            if stock_cases:
+                fields["stock"] = Case(*stock_cases, default=F("stock"), output_field=IntegerField())
+            if fields:
+                Product.objects.filter(id__in=chunk).update(**fields)
+
+        # Cart totals and cached product pages, once for the whole batch
+        if repriced:
+            cart_products_changed(repriced)
+
+    if updated:
+        invalidate_product_cache(all_products=True)
+
+    return Response({"updated": len(updated), "failed": failed})
+
+
+# (price, absolute stock, stock delta) from one bulk update row
+def parse_stock_price_change(change):
+    if not isinstance(change, dict):
+        raise ValueError("Each update must be an object")
+    if "stock" in change and "stock_delta" in change:
+        raise ValueError("Give stock or stock_delta, not both")
+
+    try:
+        price = Decimal(str(change["price"])).quantize(Decimal("0.01")) if "price" in change else None
+        stock = int(change["stock"]) if "stock" in change else None
+        stock_delta = int(change["stock_delta"]) if "stock_delta" in change else None
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError("price, stock and stock_delta must be numbers")
+
+    if price is None and stock is None and stock_delta is None:
+        raise ValueError("Nothing to update")
+    if price is not None and (price < 0 or price >= Decimal("100000000")):
+        raise ValueError("Invalid price")
+    return price, stock, stock_delta
+
+
+# CATALOG IMPORT (Manager only)
+# Upload a CSV or JSONL file as "file" (or send it as the raw body);
+# products are upserted by sku in chunks. ?file_format=csv|jsonl, default from
+# the file name / content type (DRF reserves ?format=, hence file_format).
+# Large catalogs: use the import_products command.
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def import_catalog(request):
+    if request.user.role != "manager":
+        return Response({"error": "Only managers can import products"}, status=403)
+
+    # Only multipart bodies go through DRF's parsers (which would refuse a
+    # text/csv body with 415); anything else is read as the file itself
+    content_type = request.content_type.split(";")[0].strip()
+    if content_type == "multipart/form-data":
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"error": "Upload the file as \"file\""}, status=400)
+        name = upload.name
+        raw = upload
+    else:
+        name = ""
+        raw = io.BytesIO(request.body)
+
+    fmt = request.GET.get("file_format")
+    if fmt is None:
+        jsonl = name.endswith((".jsonl", ".ndjson")) or content_type in ("application/x-ndjson", "application/jsonl")
+        fmt = "jsonl" if jsonl else "csv"
+    if fmt not in FORMATS:
+        return Response({"error": "format must be csv or jsonl"}, status=400)
+
+    stream = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+    try:
+        result = import_products(stream, fmt)
+    except (UnicodeDecodeError, csv.Error):
+        return Response({"error": f"File is not valid {fmt}"}, status=400)
+
+    return Response(result)
+
+
+# CATALOG EXPORT (Manager only): ?file_format=csv|jsonl, streamed so memory
+# use doesn't grow with the catalog
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_catalog(request):
+    if request.user.role != "manager":
+        return Response({"error": "Only managers can export products"}, status=403)
+
+    fmt = request.GET.get("file_format", "csv")
+    if fmt not in FORMATS:
+        return Response({"error": "format must be csv or jsonl"}, status=400)
+
+    content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    response = StreamingHttpResponse(export_products(fmt), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="products.{fmt}"'
+    return response
+
+
+# FREQUENTLY BOUGHT TOGETHER (public)
+# Precomputed by update_recommendations; one lookup on (product, rank).
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@cache_product_response(product_version)
+def product_recommendations(request, pk):
+    rows = (
+        ProductRecommendation.objects.filter(product_id=pk)
+        .order_by("rank").values_list(*RECOMMENDATION_RENDERER.columns)
+    )
+    results = RECOMMENDATION_RENDERER(rows)
+
+    if not results and not Product.objects.filter(id=pk).exists():
+        return Response({"error": "Product not found"}, status=404)
+
+    return Response({"product_id": pk, "results": results})
+
+
+RECOMMENDATION_RENDERER = RowRenderer(
+    ("id", "recommended_id"),
+    ("name", "recommended__name"),
+    ("price", "recommended__price", decimal_string(2)),
+    ("orders_together", "orders"),
+)
+
+
 # GET single product / UPDATE / DELETE (Manager only)
 @api_view(['GET', 'PUT', 'DELETE'])
+@cache_product_response(product_version)
 def product_detail(request, pk):
 
     try:
-        product = Product.objects.get(pk=pk)
+        product = Product.objects.select_related("category").get(pk=pk)
     except Product.DoesNotExist:
         return Response({"error": "Product not found"}, status=404)
 
@@ -67,12 +412,29 @@ def product_detail(request, pk):
     if request.method == 'PUT':
         serializer = ProductSerializer(product, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            old_name, old_price = product.name, product.price
+            old_category_id = product.category_id
+
+            with transaction.atomic():
+                serializer.save()
+                if product.category_id != old_category_id:
+                    adjust_category_counts({old_category_id: -1, product.category_id: 1})
+                index_products([product])
+            invalidate_product_cache([product.id])
+
+            # Carts show this product's name and price
+            if (product.name, product.price) != (old_name, old_price):
+                cart_products_changed([product.id])
+
             return Response(serializer.data)
         return Response(serializer.errors, status=400)
 
 
     # DELETE product
     if request.method == 'DELETE':
-        product.delete()
+        cart_products_changed([product.id])
+        with transaction.atomic():
+            product.delete()
+            adjust_category_counts({product.category_id: -1})
+        invalidate_product_cache([pk])
         return Response({"message": "Product deleted"}, status=204)
@@ -0,0 +1,36 @@
+from django.http import StreamingHttpResponse
+from products.transfer import FORMATS, keyset_rows, stream_records
+
+# Report downloads: ?file_format=csv|jsonl (DRF reserves ?format=).
+# Records are rendered and written as they are read, chunk_size rows per
+# query, so memory stays flat whatever the size.
+# The formats and the writer are the catalog export's (products.transfer).
+EXPORT_CHUNK_SIZE = 2000
+
+
+def export_response(records, fields, fmt, filename):
+    content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    response = StreamingHttpResponse(stream_records(records, fields, fmt, EXPORT_CHUNK_SIZE), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+# ?file_format=csv|jsonl -> the format, None for a normal JSON response,
+# or ValueError
+def parse_file_format(request):
+    fmt = request.GET.get("file_format")
+    if fmt is not None and fmt not in FORMATS:
+        raise ValueError("file_format must be csv or jsonl")
+    return fmt
+
+
+# Records for the rows of `queryset`, read EXPORT_CHUNK_SIZE at a time in
+# `key` order (see keyset_rows). key=None takes `queryset` as already
+# ordered values_list() rows and reads them in one query: for per-product
+# aggregates, where paging would redo the GROUP BY for every chunk.
+def rendered_records(renderer, queryset, key=("id",), limit=None):
+    if key is None:
+        return map(renderer.render_row, queryset)
+
+    columns = renderer.columns_with(*(field.lstrip("-") for field in key))
+    return map(renderer.render_row, keyset_rows(queryset, columns, key, EXPORT_CHUNK_SIZE, limit))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.locks import LockTimeout
+from reports.rollups import update_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Add orders placed since the last run to the daily sales rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Orders per transaction")
+
+    def handle(self, *args, **options):
+        try:
+            orders = update_sales_rollups(chunk_size=options["chunk_size"])
+        except LockTimeout:
+            raise CommandError("Another rollup run is still going")
+        self.stdout.write(f"Rolled up {orders} orders")
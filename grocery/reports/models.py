@@ -1,3 +1,33 @@
 from django.db import models
+from products.models import Category, Product
 
-# Create your models here.
+
+# Daily sales rollups, filled from orders by reports.rollups.update_sales_rollups
+# so date-range reports read one row per day and product/category instead
+# of every order line. `orders` counts orders with at least one such line.
+class DailyProductSales(models.Model):
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'product')
+
+
+class DailyCategorySales(models.Model):
+    day = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'category')
+
+
+# Highest order id already rolled up (a single row)
+class SalesRollupCheckpoint(models.Model):
+    last_order_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
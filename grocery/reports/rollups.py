@@ -0,0 +1,96 @@
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+from orders.archive import advance_checkpoint, job_lock, order_chunks, settled_order_id
+from . models import DailyCategorySales, DailyProductSales, SalesRollupCheckpoint
+
+ROLLUP_FIELDS = ["units", "revenue", "orders"]
+
+
+# Add orders placed since the last run to the daily rollups. Run it every
+# few minutes; checkout itself doesn't touch the rollups, so the hot
+# day x category rows never make checkouts wait on each other. Each chunk
+# of orders is aggregated in the database and written together with the
+# checkpoint, so an interrupted run resumes where it stopped. full=True
+# rebuilds from every order, archive included. Returns orders rolled up;
+# LockTimeout if another run is still going.
+def update_sales_rollups(full=False, chunk_size=5000):
+    with job_lock("sales_rollups"):
+        SalesRollupCheckpoint.objects.get_or_create(id=1)
+        with transaction.atomic():
+            checkpoint = SalesRollupCheckpoint.objects.select_for_update().get(id=1)
+            if full:
+                DailyProductSales.objects.all().delete()
+                DailyCategorySales.objects.all().delete()
+                checkpoint.last_order_id = 0
+                checkpoint.save()
+
+        rolled_up = 0
+        overtaken = False
+
+        # Archived orders are only read on a full rebuild
+        chunks = order_chunks(checkpoint.last_order_id, settled_order_id(), include_archive=full, chunk_size=chunk_size)
+        for item_model, after, last_id, count, live in chunks:
+            if live and overtaken:
+                continue
+            lines = item_model.objects.filter(order_id__gt=after, order_id__lte=last_id).annotate(
+                day=TruncDate("order__created_at")
+            )
+
+            with transaction.atomic():
+                # Checked per chunk as well, for a run whose lock lapsed or
+                # that runs against another cache. Live orders past this
+                # point are the other run's; the archive still needs reading.
+                if live and not advance_checkpoint(SalesRollupCheckpoint, after, last_id):
+                    overtaken = True
+                    continue
+                add_to_rollup(DailyProductSales, "product_id", daily_totals(lines, "product_id"))
+                add_to_rollup(DailyCategorySales, "category_id", daily_totals(lines, "product__category_id"))
+
+            rolled_up += count
+
+    return rolled_up
+
+
+# (day, key, units, revenue, distinct orders) per day and value of the
+# `column` key, one GROUP BY query
+def daily_totals(lines, column):
+    return (
+        lines.values_list("day", column)
+        .annotate(
+            units=Sum("quantity"),
+            revenue=Sum(F("price") * F("quantity"), output_field=DecimalField(max_digits=14, decimal_places=2)),
+            orders=Count("order_id", distinct=True)
+        )
+        .order_by()
+    )
+
+
+# Add daily_totals() rows to the rollup rows for their (day, key), creating
+# missing rows. Chunks never share an order, so order counts simply add up.
+def add_to_rollup(model, key, totals):
+    totals = list(totals)
+    if not totals:
+        return
+
+    existing = {
+        (row.day, getattr(row, key)): row
+        for row in model.objects.filter(
+            day__in={total[0] for total in totals},
+            **{f"{key}__in": {total[1] for total in totals}}
+        )
+    }
+
+    new_rows = []
+    changed_rows = []
+    for day, key_value, *values in totals:
+        row = existing.get((day, key_value))
+        if row is None:
+            new_rows.append(model(day=day, **{key: key_value}, **dict(zip(ROLLUP_FIELDS, values))))
+        else:
+            for field, value in zip(ROLLUP_FIELDS, values):
+                setattr(row, field, getattr(row, field) + value)
+            changed_rows.append(row)
+
+    model.objects.bulk_create(new_rows, batch_size=500)
+    model.objects.bulk_update(changed_rows, ROLLUP_FIELDS, batch_size=500)
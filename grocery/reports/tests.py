@@ -1,3 +1,174 @@
+from datetime import datetime, timedelta
+from unittest import mock
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from orders.archive import archive_orders, job_lock, order_chunks
+from orders.models import Order, OrderItem
+from products.locks import LockTimeout
+from products.models import Category, Product
+from users.models import User
+from . models import DailyCategorySales, DailyProductSales
+from . rollups import update_sales_rollups
 
-# Create your tests here.
+
+# An order of (product, price, quantity) lines; by default a day old, so
+# the checkpointed jobs read it
+def place_order(user, lines, placed_at=None):
+    order = Order.objects.create(user=user, total_price=sum(price * quantity for _, price, quantity in lines))
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, price=price, quantity=quantity)
+        for product, price, quantity in lines
+    ])
+    Order.objects.filter(id=order.id).update(created_at=placed_at or timezone.now() - timedelta(days=1))
+    return order
+
+
+class SalesRollupTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="alice", password="x")
+        self.fruit = Category.objects.create(name="fruit")
+        self.apple = Product.objects.create(name="apple", category=self.fruit, price="2.00", stock=10)
+        place_order(self.user, [(self.apple, 2, 1)])
+        place_order(self.user, [(self.apple, 2, 3)])
+
+    def units(self):
+        return sum(DailyProductSales.objects.values_list("units", flat=True))
+
+    def test_orders_are_rolled_up_once(self):
+        self.assertEqual(update_sales_rollups(chunk_size=1), 2)
+        self.assertEqual(update_sales_rollups(), 0)
+
+        place_order(self.user, [(self.apple, 2, 5)])
+
+        self.assertEqual(update_sales_rollups(), 1)
+        self.assertEqual(self.units(), 9)
+        self.assertEqual(DailyCategorySales.objects.get().orders, 3)
+
+    def test_run_that_was_overtaken_stops(self):
+        update_sales_rollups()
+
+        # A run that read the checkpoint before the first one moved it
+        stale_chunks = lambda after, *args, **kwargs: order_chunks(0, *args, **kwargs)
+        with mock.patch("reports.rollups.order_chunks", stale_chunks):
+            self.assertEqual(update_sales_rollups(chunk_size=1), 0)
+
+        self.assertEqual(self.units(), 4)
+
+    def test_overtaken_rebuild_still_reads_the_archive(self):
+        archive_orders(timezone.now() - timedelta(hours=12))
+        place_order(self.user, [(self.apple, 2, 5)])
+        update_sales_rollups()
+
+        # Another run takes over the live orders; the archive is still this run's
+        with mock.patch("reports.rollups.advance_checkpoint", return_value=False):
+            self.assertEqual(update_sales_rollups(full=True), 2)
+
+        self.assertEqual(self.units(), 4)
+
+    def test_one_run_at_a_time(self):
+        with job_lock("sales_rollups"):
+            with self.assertRaises(LockTimeout):
+                update_sales_rollups()
+
+        self.assertFalse(DailyProductSales.objects.exists())
+
+
+class RevenueSeriesTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="manager", password="x", role="manager"))
+        self.user = User.objects.create_user(username="alice", password="x")
+        fruit = Category.objects.create(name="fruit")
+        veg = Category.objects.create(name="veg")
+        self.apple = Product.objects.create(name="apple", category=fruit, price="2.00", stock=10)
+        self.leek = Product.objects.create(name="leek", category=veg, price="1.00", stock=10)
+
+        # Tuesday and Saturday of the week starting Monday 2026-09-07
+        place_order(self.user, [(self.apple, 2, 5)], datetime(2026, 9, 8, 10))
+        place_order(self.user, [(self.apple, 2, 3), (self.leek, 1, 4)], datetime(2026, 9, 12, 18))
+
+    def series(self, params):
+        response = self.client.get(f"/reports/revenue/?{params}")
+        self.assertEqual(response.status_code, 200)
+        return [(str(row["period"])[:10], row["revenue"], row["orders"]) for row in response.data["results"]]
+
+    def test_empty_days_are_filled_with_zero(self):
+        self.assertEqual(self.series("interval=day&start=2026-09-07&end=2026-09-13"), [
+            ("2026-09-07", 0.0, 0),
+            ("2026-09-08", 10.0, 1),
+            ("2026-09-09", 0.0, 0),
+            ("2026-09-10", 0.0, 0),
+            ("2026-09-11", 0.0, 0),
+            ("2026-09-12", 10.0, 1),
+            ("2026-09-13", 0.0, 0),
+        ])
+        self.assertEqual(
+            self.series("interval=day&start=2026-09-12&end=2026-09-12&category=veg"),
+            [("2026-09-12", 4.0, 1)]
+        )
+
+    def test_week_ending_mid_range_is_cached_whole(self):
+        self.assertEqual(self.series("interval=week&start=2026-09-07&end=2026-09-10"), [("2026-09-07", 20.0, 2)])
+
+        self.assertEqual(self.series("interval=week&start=2026-09-07&end=2026-09-13"), [("2026-09-07", 20.0, 2)])
+        self.assertEqual(self.series("interval=week&start=2026-09-01&end=2026-09-20"), [
+            ("2026-08-31", 0.0, 0),
+            ("2026-09-07", 20.0, 2),
+            ("2026-09-14", 0.0, 0),
+        ])
+
+    def test_archived_orders_are_counted(self):
+        archive_orders(datetime(2026, 9, 10))
+
+        self.assertEqual(self.series("interval=week&start=2026-09-07&end=2026-09-13"), [("2026-09-07", 20.0, 2)])
+        self.assertEqual(
+            self.series(f"interval=day&start=2026-09-08&end=2026-09-09&product={self.apple.id}"),
+            [("2026-09-08", 10.0, 1), ("2026-09-09", 0.0, 0)]
+        )
+
+
+@mock.patch("reports.exports.EXPORT_CHUNK_SIZE", 2)
+class ReportExportTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="manager", password="x", role="manager"))
+        self.user = User.objects.create_user(username="alice", password="x")
+        fruit = Category.objects.create(name="fruit")
+        self.products = Product.objects.bulk_create([
+            Product(name=f"product {i}", category=fruit, price="1.00", stock=i * 20, popularity=i % 3)
+            for i in range(5)
+        ])
+
+    def download(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode().splitlines()
+
+    def test_order_lines_stream_in_order_archive_first(self):
+        orders = [place_order(self.user, [(product, 1, 2) for product in self.products[:3]]) for _ in range(3)]
+        archive_orders(timezone.now() - timedelta(hours=12))
+        orders.append(place_order(self.user, [(self.products[4], 1, 1)], timezone.now()))
+
+        lines = self.download("/reports/orders/export/?include_archive=true")
+
+        self.assertEqual(lines[0].split(",")[:2], ["order_id", "user_id"])
+        self.assertEqual(
+            [int(line.split(",")[0]) for line in lines[1:]],
+            [order.id for order in orders[:3] for _ in range(3)] + [orders[3].id]
+        )
+
+    def test_sales_export_follows_the_sort_and_limit(self):
+        lines = self.download("/reports/sales/?file_format=csv&sort=most_sold&limit=3")
+
+        expected = sorted(self.products, key=lambda p: (-p.popularity, -p.id))[:3]
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], [p.name for p in expected])
+
+        lines = self.download("/reports/low-stock/?file_format=csv")
+        self.assertEqual(len(lines), 4)
@@ -0,0 +1,101 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncWeek
+from django.utils import timezone
+from orders.archive import ORDER_SETTLE_TIME, order_tables
+from orders.models import ArchivedOrder
+
+# interval -> (database truncation, bucket length)
+INTERVALS = {
+    "hour": (TruncHour, timedelta(hours=1)),
+    "day": (TruncDay, timedelta(days=1)),
+    "week": (TruncWeek, timedelta(weeks=1)),
+}
+MAX_BUCKETS = 1000
+
+
+# Start of the bucket containing `moment` (weeks start on Monday, as TruncWeek)
+def bucket_start(moment, interval):
+    if interval == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == "week":
+        day -= timedelta(days=day.weekday())
+    return day
+
+
+# Revenue and order count per bucket for orders placed in [since, until),
+# rounded out to whole buckets, every bucket present (empty ones as zero).
+# Filtering by category or product counts those order lines only;
+# otherwise revenue is the order totals, discounts included. A bucket is
+# closed once its orders have settled: closed buckets are cached and never
+# recomputed, so a repeat load only aggregates the open bucket at the end.
+def revenue_series(interval, since, until, category_id=None, product_id=None):
+    trunc, step = INTERVALS[interval]
+
+    buckets = []
+    bucket = bucket_start(since, interval)
+    while bucket < until:
+        buckets.append(bucket)
+        bucket += step
+    if len(buckets) > MAX_BUCKETS:
+        raise ValueError(f"At most {MAX_BUCKETS} {interval} buckets per request")
+
+    settled = timezone.now() - ORDER_SETTLE_TIME
+    keys = {
+        bucket: f"reports:revenue:{interval}:{category_id or ''}:{product_id or ''}:{bucket.isoformat()}"
+        for bucket in buckets
+        if bucket + step <= settled
+    }
+    cached = cache.get_many(list(keys.values()))
+    totals = {bucket: cached[key] for bucket, key in keys.items() if key in cached}
+
+    missing = [bucket for bucket in buckets if bucket not in totals]
+    if missing:
+        # To the end of the last bucket: a cached bucket must be complete
+        # whatever `until` the request that computed it had
+        computed = aggregate_revenue(trunc, missing[0], buckets[-1] + step, category_id, product_id)
+        for bucket in missing:
+            totals[bucket] = computed.get(bucket, (Decimal("0"), 0))
+
+        cache.set_many(
+            {keys[bucket]: totals[bucket] for bucket in missing if bucket in keys},
+            settings.REPORT_CACHE_TIMEOUT
+        )
+
+    return [(bucket, *totals[bucket]) for bucket in buckets]
+
+
+# bucket -> (revenue, orders) with one GROUP BY per order table; the
+# archive is only aggregated when it has orders in the range
+def aggregate_revenue(trunc, since, until, category_id=None, product_id=None):
+    include_archive = ArchivedOrder.objects.filter(created_at__gte=since, created_at__lt=until).exists()
+    totals = {}
+
+    for order_model, item_model in order_tables(include_archive):
+        if category_id or product_id:
+            rows = item_model.objects.filter(order__created_at__gte=since, order__created_at__lt=until)
+            if category_id:
+                rows = rows.filter(product__category_id=category_id)
+            if product_id:
+                rows = rows.filter(product_id=product_id)
+            rows = rows.annotate(period=trunc("order__created_at")).values("period").annotate(
+                revenue=Sum(F("price") * F("quantity"), output_field=DecimalField(max_digits=14, decimal_places=2)),
+                orders=Count("order_id", distinct=True)
+            )
+        else:
+            rows = order_model.objects.filter(created_at__gte=since, created_at__lt=until)
+            rows = rows.annotate(period=trunc("created_at")).values("period").annotate(
+                revenue=Sum("total_price"),
+                orders=Count("id")
+            )
+
+        # Order tables never share an order, so their totals add up
+        for period, revenue, orders in rows.order_by().values_list("period", "revenue", "orders"):
+            previous_revenue, previous_orders = totals.get(period, (Decimal("0"), 0))
+            totals[period] = (previous_revenue + revenue, previous_orders + orders)
+
+    return totals
@@ -4,4 +4,7 @@ from . import views
 urlpatterns = [
     path('sales/', views.sales_report),
     path('low-stock/', views.low_stock_products),
+    path('categories/', views.category_sales),
+    path('revenue/', views.revenue_timeseries),
+    path('orders/export/', views.export_orders),
 ]
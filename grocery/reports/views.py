@@ -2,7 +2,15 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from products.models import Product
+from django.db.models import Sum
+from products.models import Category, Product
+from orders.archive import order_tables
+from products.renderers import RowRenderer, decimal_string, to_float
+from products.trending import trending_weight
+from . exports import export_response, parse_file_format, rendered_records
+from . models import DailyCategorySales, DailyProductSales
+from . timeseries import INTERVALS, revenue_series
+from datetime import date, datetime, time, timedelta
 
 
 # Manager only
@@ -21,30 +29,287 @@ def sales_report(request):
     sort = request.GET.get("sort")
     category = request.GET.get("category")
 
+    try:
+        limit = parse_limit(request)
+        date_range = parse_date_range(request)
+        fmt = parse_file_format(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    # With start/end: sales in that range, read from the daily rollups
+    if date_range:
+        rows = range_sales(date_range, category, sort, limit)
+        if fmt:
+            records = rendered_records(RANGE_SALES_RENDERER, rows, key=None)
+            return export_response(records, RANGE_SALES_RENDERER.keys, fmt, "sales")
+        return Response(RANGE_SALES_RENDERER(rows))
+
     products = Product.objects.all()
 
-    # Filter by category
+    # Filter by category (exact name, indexed FK)
     if category:
-        products = products.filter(category__icontains=category)
-
-    # Sorting logic
-    if sort == "most_sold":
-        products = products.order_by('-popularity')
-    elif sort == "least_sold":
-        products = products.order_by('popularity')
-
-    data = [
-        {
-            "product": p.name,
-            "category": p.category,
-            "price": float(p.price),
-            "stock_left": p.stock,
-            "times_sold": p.popularity
-        }
-        for p in products
-    ]
+        products = products.filter(category__name=category)
+
+    # Sorting logic: each ordering walks an index (product_popularity_idx,
+    # product_trending_idx); with limit= only the top rows are read
+    ordering = SALES_ORDERINGS.get(sort, ("id",))
+
+    if fmt:
+        records = with_trending_scores(rendered_records(SALES_RENDERER, products, ordering, limit))
+        return export_response(records, SALES_RENDERER.keys, fmt, "sales")
+
+    products = products.order_by(*ordering)
+    if limit:
+        products = products[:limit]
+
+    rows = products.values_list(*SALES_RENDERER.columns)
+    return Response(list(with_trending_scores(SALES_RENDERER(rows))))
+
+
+# sort= value -> product ordering, id breaking ties
+SALES_ORDERINGS = {
+    "most_sold": ("-popularity", "-id"),
+    "least_sold": ("popularity", "id"),
+    "trending": ("-trending", "-id"),
+}
+
+
+# stored trending scores -> decayed as of now
+def with_trending_scores(records):
+    weight = trending_weight()
+    for record in records:
+        record["trending_score"] = round(record["trending_score"] / weight, 4)
+        yield record
+
+
+SALES_RENDERER = RowRenderer(
+    ("product", "name"),
+    ("category", "category__name"),
+    ("price", "price", to_float),
+    ("stock_left", "stock"),
+    ("times_sold", "popularity"),
+    ("trending_score", "trending"),
+)
+
+
+# Per-product sales between two days (inclusive), one GROUP BY over the
+# rollup rows of those days, as RANGE_SALES_RENDERER rows. Up to date as
+# of the last update_sales_rollups.
+def range_sales(date_range, category=None, sort=None, limit=None):
+    rows = DailyProductSales.objects.filter(day__range=date_range)
+    if category:
+        rows = rows.filter(product__category__name=category)
+
+    rows = rows.values(
+        "product_id", "product__name", "product__category__name", "product__price", "product__stock"
+    ).annotate(
+        units=Sum("units"), revenue=Sum("revenue"), orders=Sum("orders")
+    )
+
+    if sort == "least_sold":
+        rows = rows.order_by("units", "product_id")
+    elif sort == "revenue":
+        rows = rows.order_by("-revenue", "product_id")
+    else:
+        rows = rows.order_by("-units", "product_id")
+
+    if limit:
+        rows = rows[:limit]
+
+    return rows.values_list(*RANGE_SALES_RENDERER.columns)
 
-    return Response(data)
+
+RANGE_SALES_RENDERER = RowRenderer(
+    ("product", "product__name"),
+    ("category", "product__category__name"),
+    ("price", "product__price", to_float),
+    ("stock_left", "product__stock"),
+    ("product_id", "product_id"),
+    ("units_sold", "units"),
+    ("revenue", "revenue", to_float),
+    ("orders", "orders"),
+)
+
+
+# SALES BY CATEGORY (Manager only)
+# ?start=2026-10-01&end=2026-10-07 (default: the last 7 days), from the
+# daily rollups, highest revenue first
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def category_sales(request):
+    if not manager_required(request.user):
+        return Response({"error": "Only managers can view sales reports"}, status=403)
+
+    try:
+        date_range = parse_date_range(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    if not date_range:
+        today = date.today()
+        date_range = (today - timedelta(days=6), today)
+
+    rows = (
+        DailyCategorySales.objects.filter(day__range=date_range)
+        .values("category_id", "category__name")
+        .annotate(units=Sum("units"), revenue=Sum("revenue"), orders=Sum("orders"))
+        .order_by("-revenue", "category_id")
+    )
+
+    return Response({
+        "start": date_range[0],
+        "end": date_range[1],
+        "results": CATEGORY_SALES_RENDERER(rows.values_list(*CATEGORY_SALES_RENDERER.columns))
+    })
+
+
+CATEGORY_SALES_RENDERER = RowRenderer(
+    ("category", "category__name"),
+    ("units_sold", "units"),
+    ("revenue", "revenue", to_float),
+    ("orders", "orders"),
+)
+
+
+# ORDER EXPORT (Manager only)
+# ?file_format=csv|jsonl (default csv), optional start/end and
+# include_archive=true. One line per order item, oldest orders first.
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_orders(request):
+    if not manager_required(request.user):
+        return Response({"error": "Only managers can export orders"}, status=403)
+
+    try:
+        date_range = parse_date_range(request)
+        fmt = parse_file_format(request) or "csv"
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    include_archive = request.GET.get("include_archive") == "true"
+
+    def records():
+        # the archive holds the oldest orders
+        for order_model, item_model in reversed(order_tables(include_archive)):
+            lines = item_model.objects.all()
+            if date_range:
+                lines = lines.filter(
+                    order__created_at__gte=datetime.combine(date_range[0], time.min),
+                    order__created_at__lt=datetime.combine(date_range[1] + timedelta(days=1), time.min)
+                )
+            yield from rendered_records(ORDER_LINE_RENDERER, lines, ("order_id", "id"))
+
+    return export_response(records(), ORDER_LINE_RENDERER.keys, fmt, "orders")
+
+
+# Money as exact decimal strings: this is what finance reconciles against
+money = decimal_string(2)
+
+
+def line_total_money(price, quantity):
+    return money(price * quantity)
+
+
+ORDER_LINE_RENDERER = RowRenderer(
+    ("order_id", "order_id"),
+    ("user_id", "order__user_id"),
+    ("created_at", "order__created_at"),
+    ("order_total", "order__total_price", money),
+    ("product_id", "product_id"),
+    ("product", "product__name"),
+    ("quantity", "quantity"),
+    ("price", "price", money),
+    ("total", ("price", "quantity"), line_total_money),
+)
+
+
+# REVENUE OVER TIME (Manager only)
+# ?interval=hour|day|week&start=YYYY-MM-DD&end=YYYY-MM-DD&category=fruit&product=12
+# Aggregated in the database; closed periods come from the cache. Hours
+# and weeks are whole even where start or end falls inside one.
+DEFAULT_SERIES_DAYS = {"hour": 2, "day": 30, "week": 84}
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def revenue_timeseries(request):
+    if not manager_required(request.user):
+        return Response({"error": "Only managers can view sales reports"}, status=403)
+
+    interval = request.GET.get("interval", "day")
+    if interval not in INTERVALS:
+        return Response({"error": f"interval must be one of: {', '.join(INTERVALS)}"}, status=400)
+
+    try:
+        date_range = parse_date_range(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    try:
+        product_id = int(request.GET["product"]) if request.GET.get("product") else None
+    except ValueError:
+        return Response({"error": "product must be a number"}, status=400)
+
+    if not date_range:
+        today = date.today()
+        date_range = (today - timedelta(days=DEFAULT_SERIES_DAYS[interval] - 1), today)
+    since = datetime.combine(date_range[0], time.min)
+    until = datetime.combine(date_range[1] + timedelta(days=1), time.min)
+
+    category_id = None
+    category = request.GET.get("category")
+    if category:
+        category_id = Category.objects.filter(name=category).values_list("id", flat=True).first()
+        if category_id is None:
+            return Response({"error": "Category not found"}, status=404)
+
+    try:
+        series = revenue_series(interval, since, until, category_id, product_id)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    return Response({
+        "interval": interval,
+        "start": date_range[0],
+        "end": date_range[1],
+        "results": [
+            {"period": period, "revenue": float(revenue), "orders": orders}
+            for period, revenue, orders in series
+        ]
+    })
+
+
+# ?limit=N, or None
+def parse_limit(request):
+    limit = request.GET.get("limit")
+    if not limit:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError("limit must be a number")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return limit
+
+
+# ?start=YYYY-MM-DD&end=YYYY-MM-DD (inclusive) -> (start, end), or None
+# when neither is given
+def parse_date_range(request):
+    start = request.GET.get("start")
+    end = request.GET.get("end")
+    if not start and not end:
+        return None
+    if not start or not end:
+        raise ValueError("start and end must be given together")
+
+    try:
+        start, end = date.fromisoformat(start), date.fromisoformat(end)
+    except ValueError:
+        raise ValueError("start and end must be dates (YYYY-MM-DD)")
+    if start > end:
+        raise ValueError("start must not be after end")
+    return start, end
 
 
 @api_view(['GET'])
@@ -55,20 +320,30 @@ def low_stock_products(request):
     if request.user.role != "manager":
         return Response({"error": "Only managers can view low-stock items"}, status=403)
 
-    threshold = 50  # fixed alert level
-    products = Product.objects.filter(stock__lt=threshold)
-
-    data = [
-        {
-            "id": p.id,
-            "name": p.name,
-            "category": p.category,
-            "stock": p.stock,
-            "threshold": threshold,
-            "alert": "Low stock! Please restock."
-        }
-        for p in products
-    ]
+    try:
+        fmt = parse_file_format(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    products = Product.objects.filter(stock__lt=LOW_STOCK_THRESHOLD)
+
+    if fmt:
+        return export_response(rendered_records(LOW_STOCK_RENDERER, products), LOW_STOCK_RENDERER.keys, fmt, "low-stock")
+
+    rows = products.values_list(*LOW_STOCK_RENDERER.columns)
+
+    data = LOW_STOCK_RENDERER(rows)
 
     return Response(data)
 
+
+LOW_STOCK_THRESHOLD = 50  # fixed alert level
+
+LOW_STOCK_RENDERER = RowRenderer(
+    ("id", "id"),
+    ("name", "name"),
+    ("category", "category__name"),
+    ("stock", "stock"),
+    constants={"threshold": LOW_STOCK_THRESHOLD, "alert": "Low stock! Please restock."}
+)
+
@@ -1,3 +1,84 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from cart.guest import GUEST_CART_COOKIE
+from cart.models import CartItem
+from products.models import Category, Product
+from . models import User
 
-# Create your tests here.
+PASSWORD = "a-long-test-password"
+
+
+@override_settings(STOCK_RESERVATIONS=False, CART_STORE="database")
+class GuestCartMergeTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name="fruit")
+        self.apple, self.pear = Product.objects.bulk_create([
+            Product(name="apple", category=category, price="2.00", stock=10),
+            Product(name="pear", category=category, price="3.00", stock=10),
+        ])
+
+    def add_as_guest(self, product, quantity):
+        response = self.client.post("/cart/guest/add/", {"product_id": product.id, "quantity": quantity}, format="json")
+        self.assertEqual(response.status_code, 200)
+        return response.data["guest_cart"]
+
+    def cart_of(self, username):
+        return dict(
+            CartItem.objects.filter(cart__user__username=username)
+            .values_list("product__name", "quantity")
+        )
+
+    def test_register_merges_the_cookie_cart(self):
+        self.add_as_guest(self.apple, 2)
+        self.add_as_guest(self.pear, 1)
+
+        response = self.client.post("/auth/register/", {
+            "username": "alice", "email": "alice@example.com", "password": PASSWORD
+        }, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data["guest_cart_merged"])
+        self.assertEqual(response.cookies[GUEST_CART_COOKIE].value, "")
+        self.assertEqual(self.cart_of("alice"), {"apple": 2, "pear": 1})
+
+    def test_login_adds_the_token_cart_to_the_existing_cart(self):
+        alice = User.objects.create_user(username="alice", password=PASSWORD)
+        user_client = APIClient()
+        user_client.force_authenticate(alice)
+        user_client.post("/cart/add/", {"product_id": self.apple.id, "quantity": 1}, format="json")
+
+        # A client without cookies sends the token in the body instead
+        token = self.add_as_guest(self.apple, 2)
+        self.client.cookies.clear()
+        response = self.client.post("/auth/login/", {
+            "username": "alice", "password": PASSWORD, "guest_cart": token
+        }, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["guest_cart_merged"])
+        self.assertEqual(self.cart_of("alice"), {"apple": 3})
+
+    def test_tampered_or_missing_cart_is_ignored(self):
+        User.objects.create_user(username="alice", password=PASSWORD)
+
+        response = self.client.post("/auth/login/", {
+            "username": "alice", "password": PASSWORD, "guest_cart": "forged"
+        }, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("guest_cart_merged", response.data)
+        self.assertEqual(self.cart_of("alice"), {})
+
+    @override_settings(STOCK_RESERVATIONS=True)
+    def test_cart_is_kept_when_stock_ran_out(self):
+        User.objects.create_user(username="alice", password=PASSWORD)
+        self.add_as_guest(self.apple, 4)
+        Product.objects.filter(id=self.apple.id).update(stock=3)
+
+        response = self.client.post("/auth/login/", {"username": "alice", "password": PASSWORD}, format="json")
+
+        self.assertFalse(response.data["guest_cart_merged"])
+        self.assertNotIn(GUEST_CART_COOKIE, response.cookies)
+        self.assertEqual(self.cart_of("alice"), {})
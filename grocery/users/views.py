@@ -6,6 +6,7 @@ from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken
 from . serializers import RegisterSerializer
 from . models import User
+from cart.guest import GUEST_CART_COOKIE, load_guest_cart, merge_guest_cart
 
 # Generate JWT Tokens
 def get_tokens_for_user(user):
@@ -25,10 +26,11 @@ def register_user(request):
     if serializer.is_valid():
         user = serializer.save()
         tokens = get_tokens_for_user(user)
-        return Response({
+        response = Response({
             "message": "User registered successfully",
             "tokens": tokens
         }, status=status.HTTP_201_CREATED)
+        return adopt_guest_cart(request, user, response)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -48,10 +50,26 @@ def login_user(request):
 
     tokens = get_tokens_for_user(user)
 
-    return Response({
+    response = Response({
         "message": "Login successful",
         "tokens": tokens
     })
+    return adopt_guest_cart(request, user, response)
+
+
+# Merge the anonymous cart (cookie, or "guest_cart" in the body) into the
+# user's cart and drop the cookie once it's merged
+def adopt_guest_cart(request, user, response):
+    lines = load_guest_cart(request, request.data.get("guest_cart"))
+    if not lines:
+        return response
+
+    if merge_guest_cart(user, lines):
+        response.delete_cookie(GUEST_CART_COOKIE)
+        response.data["guest_cart_merged"] = True
+    else:
+        response.data["guest_cart_merged"] = False
+    return response
 
 
 